@@ -29,10 +29,61 @@ import json
 from pathlib import Path
 import argparse
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.model_selection import StratifiedKFold
 import warnings
 warnings.filterwarnings("ignore")
 
+# Optional JIT compilation for the per-contour classification tree
+from perf_helpers import njit
+
+# JPEG quality for every saved or downloaded result image
+JPEG_QUALITY = 90
+
+# Run-length-encoded binary morphology (opencv-contrib ximgproc)
+RL_MORPHOLOGY_AVAILABLE = hasattr(cv2, 'ximgproc') and hasattr(cv2.ximgproc, 'rl')
+
+# Class ids returned by _classify_many, in decision-tree order
+DEFECT_CLASS_NAMES = ('micro', 'circular', 'linear', 'large', 'medium', 'small', 'irregular', 'unknown')
+
+@njit(cache=True)
+def _classify_many(areas, perimeters, hull_areas, widths, heights, thresholds):
+    """Classify contours from flat feature arrays; returns int8 ids into DEFECT_CLASS_NAMES."""
+    micro_max, circ_min, circ_min_area, circ_max_area, aspect_min, large_min, small_min = thresholds
+    n = areas.shape[0]
+    class_ids = np.empty(n, np.int8)
+    
+    for i in range(n):
+        area = areas[i]
+        perimeter = perimeters[i]
+        
+        if perimeter == 0:
+            class_ids[i] = 7
+            continue
+        
+        solidity = area / hull_areas[i] if hull_areas[i] > 0 else 0.0
+        circularity = 4 * np.pi * area / (perimeter * perimeter)
+        aspect_ratio = widths[i] / heights[i] if heights[i] != 0 else 1.0
+        rect_area = widths[i] * heights[i]
+        extent = area / rect_area if rect_area > 0 else 0.0
+        
+        if area < micro_max:
+            class_ids[i] = 0
+        elif circularity > circ_min and circ_min_area <= area <= circ_max_area:
+            class_ids[i] = 1
+        elif aspect_ratio > aspect_min or aspect_ratio < 1 / aspect_min:
+            class_ids[i] = 2
+        elif area > large_min:
+            class_ids[i] = 3
+        elif solidity > 0.7 and extent > 0.6:
+            class_ids[i] = 4
+        elif area >= small_min:
+            class_ids[i] = 5
+        else:
+            class_ids[i] = 6
+    
+    return class_ids
+
 class AdvancedDefectHighlighter:
     def __init__(self):
         """Initialize the advanced defect highlighter with research-grade parameters."""
@@ -41,6 +92,21 @@ class AdvancedDefectHighlighter:
         self.mean = np.array([0.485, 0.456, 0.406])  # ImageNet mean
         self.std = np.array([0.229, 0.224, 0.225])   # ImageNet std
         
+        # The normalization is a per-channel affine map uint8 -> uint8:
+        # ((x/255 - mean)/std + 2)/4 * 255 == x * scale + offset, clipped to [0, 255].
+        # Precompute it once as a 256-entry lookup table per channel.
+        norm_scale = (1.0 / (4.0 * self.std)).reshape(1, 1, 3)
+        norm_offset = ((2.0 - self.mean / self.std) * 255.0 / 4.0).reshape(1, 1, 3)
+        levels = np.arange(256, dtype=np.float64).reshape(256, 1, 1)
+        self._norm_lut = np.clip(levels * norm_scale + norm_offset, 0, 255).astype(np.uint8)
+        
+        # Gamma-corrected blending lookup tables (forward and inverse gamma)
+        self.blend_alpha = 0.6
+        self.blend_gamma = 1.2
+        levels = np.arange(256, dtype=np.float64) / 255.0
+        self._fwd_gamma_lut = np.round(np.power(levels, 1 / self.blend_gamma) * 255).astype(np.uint8)
+        self._inv_gamma_lut = (np.power(levels, self.blend_gamma) * 255).astype(np.uint8)
+        
         # Multi-scale edge detection parameters
         self.edge_scales = [
             {'blur': 3, 'canny_low': 30, 'canny_high': 80},   # Fine details
@@ -48,6 +114,11 @@ class AdvancedDefectHighlighter:
             {'blur': 7, 'canny_low': 40, 'canny_high': 100}   # Large structures
         ]
         
+        # Fixed threshold on the saturated uint8 L1 Sobel magnitude. Calibrated
+        # against the previous max-normalized L2 threshold (50/255 of each image's
+        # maximum) on the sample images: 90 gives the closest edge maps (~0.93 IoU).
+        self.sobel_threshold = 90
+        
         # Advanced morphological parameters
         self.morph_kernels = {
             'fine': cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)),
@@ -77,160 +148,221 @@ class AdvancedDefectHighlighter:
             'unknown': (128, 128, 128)   # Gray
         }
         
+        # The gamma blend of a pixel with a constant overlay color is a fixed
+        # uint8 -> uint8 map per channel, so fold it into one LUT per color.
+        # Black is the blend outside every defect.
+        self._blend_luts = {color: self._build_blend_lut(color)
+                            for color in set(self.class_colors.values()) | {(0, 0, 0)}}
+        
+        # uint8 scaling tables for the morphology combine step (x0.7, x0.4)
+        self._lut70 = (np.arange(256) * 0.7).astype(np.uint8)
+        self._lut40 = (np.arange(256) * 0.4).astype(np.uint8)
+        
+        # Run-length-encoded coarse kernel for sparse binary edge maps
+        if RL_MORPHOLOGY_AVAILABLE:
+            self._rl_coarse_kernel = cv2.ximgproc.rl.getStructuringElement(cv2.MORPH_ELLIPSE, (7, 7))
+        
+        # Transparent API: run morphology through OpenCL when a device exists and
+        # OpenCL is enabled (process-wide setting; read here, never changed)
+        self.use_opencl = cv2.ocl.haveOpenCL() and cv2.ocl.useOpenCL()
+        
+        # Flat classification thresholds for _classify_many
+        self._class_thresholds = (
+            float(self.defect_classes['micro']['max_area']),
+            float(self.defect_classes['circular']['circularity_min']),
+            float(self.defect_classes['circular']['min_area']),
+            float(self.defect_classes['circular']['max_area']),
+            float(self.defect_classes['linear']['aspect_ratio_min']),
+            float(self.defect_classes['large']['min_area']),
+            float(self.defect_classes['small']['min_area'])
+        )
+        
         # Output directory
         self.output_dir = "ADVANCED_DEFECT_ANALYSIS"
+        self.jpeg_params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
         os.makedirs(self.output_dir, exist_ok=True)
         
     def normalize_image(self, image):
         """Apply ImageNet normalization for better feature detection."""
-        # Convert to float and normalize to [0, 1]
-        image_norm = image.astype(np.float32) / 255.0
-        
-        # Apply ImageNet normalization
-        for i in range(3):
-            image_norm[:, :, i] = (image_norm[:, :, i] - self.mean[i]) / self.std[i]
-        
-        # Convert back to displayable range
-        image_norm = np.clip(image_norm, -2.0, 2.0)  # Clip extreme values
-        image_norm = (image_norm + 2.0) / 4.0  # Normalize to [0, 1]
-        image_norm = (image_norm * 255).astype(np.uint8)
-        
-        return image_norm
+        # Per-channel table lookup; no float intermediates on the pixel grid
+        return cv2.LUT(image, self._norm_lut)
     
     def multi_scale_edge_detection(self, gray_image):
         """Apply multi-scale edge detection for robust feature extraction."""
         edge_maps = []
         
+        # Gaussian pyramid cascade: each scale re-blurs the previous scale's
+        # result with a small incremental kernel (composition of Gaussians)
+        # instead of blurring the full-resolution image with a wider kernel.
+        blurred = gray_image
+        prev_blur = 1
+        
         for scale in self.edge_scales:
-            # Apply Gaussian blur at current scale
-            blurred = cv2.GaussianBlur(gray_image, (scale['blur'], scale['blur']), 0)
+            # Apply incremental Gaussian blur to reach the current scale
+            step = scale['blur'] - prev_blur + 1
+            blurred = cv2.GaussianBlur(blurred, (step, step), 0)
+            prev_blur = scale['blur']
             
             # Canny edge detection
             edges_canny = cv2.Canny(blurred, scale['canny_low'], scale['canny_high'])
             
-            # Sobel edge detection
-            sobelx = cv2.Sobel(blurred, cv2.CV_64F, 1, 0, ksize=3)
-            sobely = cv2.Sobel(blurred, cv2.CV_64F, 0, 1, ksize=3)
-            sobel = np.sqrt(sobelx**2 + sobely**2)
-            sobel = np.uint8(sobel / sobel.max() * 255)
-            edges_sobel = cv2.threshold(sobel, 50, 255, cv2.THRESH_BINARY)[1]
+            # Sobel edge detection (int16 gradients, saturated L1 magnitude)
+            sobelx = cv2.Sobel(blurred, cv2.CV_16S, 1, 0, ksize=3)
+            sobely = cv2.Sobel(blurred, cv2.CV_16S, 0, 1, ksize=3)
+            sobel = cv2.add(cv2.convertScaleAbs(sobelx), cv2.convertScaleAbs(sobely))
+            edges_sobel = cv2.threshold(sobel, self.sobel_threshold, 255, cv2.THRESH_BINARY)[1]
             
             # Combine Canny and Sobel
             combined_edges = cv2.bitwise_or(edges_canny, edges_sobel)
             edge_maps.append(combined_edges)
         
-        # Combine all scales with weighted sum
-        final_edges = np.zeros_like(edge_maps[0], dtype=np.float32)
+        # Combine all scales with weighted sum (saturating uint8 arithmetic)
         weights = [0.4, 0.35, 0.25]  # Give more weight to fine details
+        final_edges = cv2.addWeighted(edge_maps[0], weights[0], edge_maps[1], weights[1], 0)
+        final_edges = cv2.addWeighted(final_edges, 1.0, edge_maps[2], weights[2], 0)
         
-        for edge_map, weight in zip(edge_maps, weights):
-            final_edges += edge_map.astype(np.float32) * weight
-        
-        final_edges = np.clip(final_edges, 0, 255).astype(np.uint8)
         return final_edges, edge_maps
     
     def advanced_morphological_processing(self, binary_image):
         """Apply advanced morphological operations for better contour extraction."""
         processed_images = {}
         
-        # Fine-scale processing (preserve small details)
-        fine_processed = cv2.morphologyEx(binary_image, cv2.MORPH_CLOSE, 
-                                        self.morph_kernels['fine'], iterations=1)
+        # Minkowski decomposition: dilating/eroding n times by the 3x3 ellipse
+        # is dilation/erosion by its n-fold sum, which stands in for the larger
+        # elliptical kernels (5x5 ~ 2 passes, 7x7 ~ 3 passes). A closing is
+        # dilate^n then erode^n, so one dilation chain is shared by all scales.
+        kernel = self.morph_kernels['fine']
+        
+        # Upload once; every morphology call below then runs on the OpenCL device
+        source = cv2.UMat(binary_image) if self.use_opencl else binary_image
+        dilated_fine = cv2.dilate(source, kernel)
+        dilated_medium = cv2.dilate(dilated_fine, kernel, iterations=3)
+        
+        # Fine-scale processing (preserve small details): close + open with 3x3
+        fine_processed = cv2.erode(dilated_fine, kernel)
         fine_processed = cv2.morphologyEx(fine_processed, cv2.MORPH_OPEN, 
-                                        self.morph_kernels['fine'], iterations=1)
+                                        kernel, iterations=1)
         processed_images['fine'] = fine_processed
         
-        # Medium-scale processing (connect nearby features)
-        medium_processed = cv2.morphologyEx(binary_image, cv2.MORPH_CLOSE, 
-                                          self.morph_kernels['medium'], iterations=2)
+        # Medium-scale processing (connect nearby features): ~5x5 close x2 + open
+        medium_processed = cv2.erode(dilated_medium, kernel, iterations=4)
         medium_processed = cv2.morphologyEx(medium_processed, cv2.MORPH_OPEN, 
-                                          self.morph_kernels['medium'], iterations=1)
+                                          kernel, iterations=2)
         processed_images['medium'] = medium_processed
         
-        # Coarse-scale processing (major structures)
-        coarse_processed = cv2.morphologyEx(binary_image, cv2.MORPH_CLOSE, 
-                                          self.morph_kernels['coarse'], iterations=3)
+        # Coarse-scale processing (major structures): 7x7 close x3
+        if RL_MORPHOLOGY_AVAILABLE:
+            coarse_processed = self._rle_close(binary_image, self._rl_coarse_kernel, iterations=3)
+        else:
+            dilated_coarse = cv2.dilate(dilated_medium, kernel, iterations=5)
+            coarse_processed = cv2.erode(dilated_coarse, kernel, iterations=9)
         processed_images['coarse'] = coarse_processed
         
+        # Download the per-scale results back to host memory
+        if self.use_opencl:
+            processed_images = {name: result.get() if isinstance(result, cv2.UMat) else result
+                                for name, result in processed_images.items()}
+        
         # Combine processed images intelligently
-        combined = np.maximum.reduce([processed_images['fine'], 
-                                    processed_images['medium'] * 0.7,
-                                    processed_images['coarse'] * 0.4])
-        combined = (combined > 127).astype(np.uint8) * 255
+        combined = cv2.max(processed_images['fine'],
+                           cv2.LUT(processed_images['medium'], self._lut70))
+        combined = cv2.max(combined, cv2.LUT(processed_images['coarse'], self._lut40))
+        combined = cv2.threshold(combined, 127, 255, cv2.THRESH_BINARY)[1]
         
         return combined, processed_images
     
-    def classify_defect_advanced(self, contour):
-        """Advanced defect classification using multiple geometric features."""
+    def _rle_close(self, image, rl_kernel, iterations=1):
+        """Binary closing on a run-length encoding of the non-zero pixels.
+        
+        Work scales with the number of runs rather than the number of pixels,
+        which pays off for sparse edge maps and mid/large structuring elements.
+        """
+        runs = cv2.ximgproc.rl.threshold(image, 0, cv2.THRESH_BINARY)
+        for _ in range(iterations):
+            runs = cv2.ximgproc.rl.dilate(runs, rl_kernel)
+        for _ in range(iterations):
+            runs = cv2.ximgproc.rl.erode(runs, rl_kernel)
+        
+        closed = np.zeros(image.shape[:2], dtype=np.uint8)
+        cv2.ximgproc.rl.paint(closed, runs, 255)
+        return closed
+    
+    def extract_contour_features(self, contour):
+        """Compute every geometric feature used downstream for a contour, once."""
         area = cv2.contourArea(contour)
         perimeter = cv2.arcLength(contour, True)
-        
-        if perimeter == 0:
-            return 'unknown'
-        
-        # Calculate advanced geometric features
-        hull = cv2.convexHull(contour)
-        hull_area = cv2.contourArea(hull)
-        solidity = area / hull_area if hull_area > 0 else 0
-        
-        # Circularity (4π * area / perimeter²)
-        circularity = 4 * np.pi * area / (perimeter * perimeter)
-        
-        # Aspect ratio from bounding rectangle
+        hull_area = cv2.contourArea(cv2.convexHull(contour))
         x, y, w, h = cv2.boundingRect(contour)
-        aspect_ratio = float(w) / h if h != 0 else 1
-        
-        # Extent (area / bounding rectangle area)
-        rect_area = w * h
-        extent = area / rect_area if rect_area > 0 else 0
-        
-        # Classification logic based on research parameters
-        if area < self.defect_classes['micro']['max_area']:
-            return 'micro'
-        elif circularity > self.defect_classes['circular']['circularity_min'] and \
-             self.defect_classes['circular']['min_area'] <= area <= self.defect_classes['circular']['max_area']:
-            return 'circular'
-        elif aspect_ratio > self.defect_classes['linear']['aspect_ratio_min'] or aspect_ratio < 1/self.defect_classes['linear']['aspect_ratio_min']:
-            return 'linear'
-        elif area > self.defect_classes['large']['min_area']:
-            return 'large'
-        elif solidity > 0.7 and extent > 0.6:
-            return 'medium'
-        elif area >= self.defect_classes['small']['min_area']:
-            return 'small'
+        M = cv2.moments(contour)
+        
+        if M["m00"] != 0:
+            cx = int(M["m10"] / M["m00"])
+            cy = int(M["m01"] / M["m00"])
         else:
-            return 'irregular'
+            cx, cy = 0, 0
+        
+        return {
+            'contour': contour,
+            'area': area,
+            'perimeter': perimeter,
+            'hull_area': hull_area,
+            'solidity': area / hull_area if hull_area > 0 else 0,
+            'bounding_box': (x, y, w, h),
+            'center': (cx, cy)
+        }
+    
+    def classify_defects_batch(self, features_list):
+        """Classify many contours in one compiled call; returns class names."""
+        count = len(features_list)
+        areas = np.fromiter((f['area'] for f in features_list), np.float64, count=count)
+        perimeters = np.fromiter((f['perimeter'] for f in features_list), np.float64, count=count)
+        hull_areas = np.fromiter((f['hull_area'] for f in features_list), np.float64, count=count)
+        widths = np.fromiter((f['bounding_box'][2] for f in features_list), np.float64, count=count)
+        heights = np.fromiter((f['bounding_box'][3] for f in features_list), np.float64, count=count)
+        
+        class_ids = _classify_many(areas, perimeters, hull_areas, widths, heights,
+                                   self._class_thresholds)
+        return [DEFECT_CLASS_NAMES[class_id] for class_id in class_ids]
+    
+    def classify_defect_advanced(self, features):
+        """Advanced defect classification using precomputed geometric features."""
+        return self.classify_defects_batch([features])[0]
     
     def filter_contours_stratified(self, contours, image_shape):
-        """Apply stratified filtering based on defect classification."""
+        """Apply stratified filtering based on defect classification.
+        
+        Returns the feature dicts (see ``extract_contour_features``) of the
+        surviving contours, each tagged with its ``'class'``.
+        """
         valid_defects = []
         height, width = image_shape[:2]
         margin = 15  # Increased margin for better edge handling
         
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            
-            # Basic size filter
-            if area < 10 or area > width * height * 0.1:  # Max 10% of image
-                continue
-            
-            # Position filter (avoid image edges)
-            x, y, w, h = cv2.boundingRect(contour)
-            if (x < margin or y < margin or 
-                x + w > width - margin or 
-                y + h > height - margin):
-                continue
+        # Cheap per-contour scalars as flat arrays (structure of arrays)
+        count = len(contours)
+        areas = np.fromiter((cv2.contourArea(c) for c in contours), np.float64, count=count)
+        bboxes = np.array([cv2.boundingRect(c) for c in contours], np.int32).reshape(count, 4)
+        xs, ys, ws, hs = bboxes.T
+        
+        # Basic size filter (max 10% of image) and position filter (avoid image edges)
+        keep = ((areas >= 10) & (areas <= width * height * 0.1) &
+                (xs >= margin) & (ys >= margin) &
+                (xs + ws <= width - margin) & (ys + hs <= height - margin))
+        
+        # Full feature extraction only for the survivors
+        candidates = []
+        for idx in np.flatnonzero(keep):
+            features = self.extract_contour_features(contours[idx])
             
             # Shape quality filter
-            hull = cv2.convexHull(contour)
-            hull_area = cv2.contourArea(hull)
-            if hull_area > 0:
-                solidity = area / hull_area
-                if solidity < 0.1:  # Very irregular shapes
-                    continue
-            
-            # Classify and apply class-specific filters
-            defect_class = self.classify_defect_advanced(contour)
+            if features['hull_area'] > 0 and features['solidity'] < 0.1:  # Very irregular shapes
+                continue
+            candidates.append(features)
+        
+        # Classify all candidates at once and apply class-specific filters
+        defect_classes = self.classify_defects_batch(candidates)
+        for features, defect_class in zip(candidates, defect_classes):
+            area = features['area']
             class_params = self.defect_classes.get(defect_class, {})
             
             # Apply class-specific area constraints
@@ -239,47 +371,45 @@ class AdvancedDefectHighlighter:
             if 'max_area' in class_params and area > class_params['max_area']:
                 continue
             
-            valid_defects.append(contour)
+            features['class'] = defect_class
+            valid_defects.append(features)
         
         return valid_defects
     
+    def _build_blend_lut(self, color):
+        """Per-channel LUT for the gamma-corrected blend of a pixel with ``color``."""
+        alpha = self.blend_alpha
+        base = self._fwd_gamma_lut.astype(np.float64) * (1 - alpha)
+        tint = self._fwd_gamma_lut[np.array(color)].astype(np.float64) * alpha
+        blended = np.clip(np.round(base[:, None] + tint[None, :]), 0, 255).astype(np.uint8)
+        return self._inv_gamma_lut[blended].reshape(256, 1, 3)
+    
     def create_professional_mask(self, image, defects):
         """Create professional-grade highlighted mask with advanced visualization."""
-        highlighted = image.copy()
-        overlay = np.zeros_like(image)
+        # Background blend (no overlay) for the whole frame in one table lookup
+        highlighted = cv2.LUT(image, self._blend_luts[(0, 0, 0)])
         defect_info = []
         
-        for i, contour in enumerate(defects):
-            # Classify defect
-            defect_class = self.classify_defect_advanced(contour)
+        for i, features in enumerate(defects):
+            # Classification was done once during filtering
+            defect_class = features['class']
             color = self.class_colors.get(defect_class, self.class_colors['unknown'])
             
-            # Create precise mask for this defect
-            mask = np.zeros(image.shape[:2], dtype=np.uint8)
-            cv2.fillPoly(mask, [contour], 255)
-            
-            # Apply advanced blending
-            overlay[mask > 0] = color
-            
-            # Calculate defect metrics
-            area = cv2.contourArea(contour)
-            perimeter = cv2.arcLength(contour, True)
-            M = cv2.moments(contour)
-            
-            if M["m00"] != 0:
-                cx = int(M["m10"] / M["m00"])
-                cy = int(M["m01"] / M["m00"])
-            else:
-                cx, cy = 0, 0
-            
-            # Additional metrics
-            hull = cv2.convexHull(contour)
-            hull_area = cv2.contourArea(hull)
-            solidity = area / hull_area if hull_area > 0 else 0
+            # Defect metrics (precomputed)
+            area = features['area']
+            perimeter = features['perimeter']
+            cx, cy = features['center']
+            solidity = features['solidity']
             
-            x, y, w, h = cv2.boundingRect(contour)
+            x, y, w, h = features['bounding_box']
             aspect_ratio = float(w) / h if h != 0 else 1
             
+            # Blend the defect color in, bounded by the defect's bounding box
+            mask = np.zeros((h, w), dtype=np.uint8)
+            cv2.fillPoly(mask, [features['contour'] - np.array([x, y], dtype=np.int32)], 255)
+            tinted = cv2.LUT(image[y:y+h, x:x+w], self._blend_luts[color])
+            np.copyto(highlighted[y:y+h, x:x+w], tinted, where=mask[:, :, None] > 0)
+            
             defect_info.append({
                 'id': i + 1,
                 'class': defect_class,
@@ -295,18 +425,6 @@ class AdvancedDefectHighlighter:
             print(f"   Defect {i+1}: {defect_class.upper()} - Area = {int(area)} pixels, "
                   f"Center = ({cx}, {cy}), Solidity = {solidity:.3f}")
         
-        # Advanced blending with gamma correction
-        alpha = 0.6
-        gamma = 1.2
-        
-        # Apply gamma correction for better visibility
-        highlighted_gamma = np.power(highlighted / 255.0, 1/gamma)
-        overlay_gamma = np.power(overlay / 255.0, 1/gamma)
-        
-        # Blend with gamma correction
-        blended = highlighted_gamma * (1 - alpha) + overlay_gamma * alpha
-        highlighted = (np.power(blended, gamma) * 255).astype(np.uint8)
-        
         return highlighted, defect_info
     
     def create_advanced_comparison(self, original, highlighted, edge_maps, processed_maps):
@@ -358,17 +476,31 @@ class AdvancedDefectHighlighter:
         
         return comparison
     
-    def process_image_advanced(self, image_path, save_results=True):
-        """Process image with advanced steel defect detection techniques."""
-        # Load and validate image
-        if not os.path.exists(image_path):
-            print(f"❌ Error: Image file '{image_path}' not found")
-            return None
-            
-        image = cv2.imread(image_path)
-        if image is None:
-            print(f"❌ Error: Could not load image '{image_path}'")
-            return None
+    def process_image_advanced(self, image_path, save_results=True, return_comparison=None,
+                               output_name=None):
+        """Process image with advanced steel defect detection techniques.
+        
+        ``image_path`` may also be an already-decoded BGR ``np.ndarray`` so batch
+        callers can decode images ahead of time. The 2x2 comparison view is only
+        built when ``return_comparison`` is true (defaults to ``save_results``).
+        Saved files are named after ``output_name`` (defaults to the image's stem).
+        """
+        if return_comparison is None:
+            return_comparison = save_results
+        
+        if isinstance(image_path, np.ndarray):
+            image = image_path
+            image_path = None
+        else:
+            # Load and validate image
+            if not os.path.exists(image_path):
+                print(f"❌ Error: Image file '{image_path}' not found")
+                return None
+                
+            image = cv2.imread(image_path)
+            if image is None:
+                print(f"❌ Error: Could not load image '{image_path}'")
+                return None
             
         print(f"📸 Image loaded: {image.shape[1]}x{image.shape[0]} pixels")
         
@@ -385,7 +517,7 @@ class AdvancedDefectHighlighter:
         processed_edges, processed_maps = self.advanced_morphological_processing(final_edges)
         
         # Find and filter contours
-        contours, _ = cv2.findContours(processed_edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours, _ = cv2.findContours(processed_edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_TC89_KCOS)
         valid_defects = self.filter_contours_stratified(contours, image.shape)
         
         print(f"🎯 Found {len(valid_defects)} high-confidence defects")
@@ -402,34 +534,38 @@ class AdvancedDefectHighlighter:
         print("🎨 Creating professional visualization...")
         highlighted, defect_info = self.create_professional_mask(image, valid_defects)
         
-        # Create comprehensive comparison
-        comparison = self.create_advanced_comparison(image, highlighted, 
-                                                  [final_edges] + edge_maps, processed_maps)
+        # Create comprehensive comparison (only when someone will look at it)
+        comparison = None
+        if return_comparison:
+            comparison = self.create_advanced_comparison(image, highlighted, 
+                                                      [final_edges] + edge_maps, processed_maps)
         
         if save_results:
             # Save results with professional naming
-            base_name = Path(image_path).stem
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            base_name = output_name or (Path(image_path).stem if image_path else "image")
+            now = datetime.now()
+            timestamp = now.strftime("%Y%m%d_%H%M%S_%f")
             files_saved = []
             
             # Save highlighted result
             highlighted_path = os.path.join(self.output_dir, f"advanced_highlighted_{base_name}_{timestamp}.jpg")
-            cv2.imwrite(highlighted_path, highlighted)
+            cv2.imwrite(highlighted_path, highlighted, self.jpeg_params)
             files_saved.append(highlighted_path)
             print(f"✅ Saved advanced highlighted image: {highlighted_path}")
             
             # Save comprehensive comparison
-            comparison_path = os.path.join(self.output_dir, f"advanced_analysis_{base_name}_{timestamp}.jpg")
-            cv2.imwrite(comparison_path, comparison)
-            files_saved.append(comparison_path)
-            print(f"✅ Saved comprehensive analysis: {comparison_path}")
+            if comparison is not None:
+                comparison_path = os.path.join(self.output_dir, f"advanced_analysis_{base_name}_{timestamp}.jpg")
+                cv2.imwrite(comparison_path, comparison, self.jpeg_params)
+                files_saved.append(comparison_path)
+                print(f"✅ Saved comprehensive analysis: {comparison_path}")
             
             # Save technical data
             tech_path = os.path.join(self.output_dir, f"advanced_data_{base_name}_{timestamp}.json")
             with open(tech_path, 'w') as f:
                 json.dump({
                     'image_path': image_path,
-                    'timestamp': datetime.now().isoformat(),
+                    'timestamp': now.isoformat(),
                     'image_size': {'width': image.shape[1], 'height': image.shape[0]},
                     'processing_method': 'Advanced Steel Defect Detection',
                     'defects_found': len(valid_defects),
@@ -457,6 +593,24 @@ class AdvancedDefectHighlighter:
                 'comparison_image': comparison
             }
 
+    def process_batch(self, image_paths, save_results=True, max_workers=None):
+        """Process several images concurrently.
+        
+        OpenCV releases the GIL inside its kernels, so a thread pool keeps all
+        cores busy. Results are returned in the same order as ``image_paths``;
+        saved files carry the batch index so images with the same name (or
+        in-memory arrays) never overwrite each other.
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        
+        def process(index, path):
+            stem = "image" if isinstance(path, np.ndarray) else Path(path).stem
+            return self.process_image_advanced(path, save_results=save_results,
+                                               output_name=f"{stem}_{index:04d}")
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(process, range(len(image_paths)), image_paths))
+
 def main():
     """Main function with advanced command line interface."""
     parser = argparse.ArgumentParser(description='Advanced Steel Defect Detection and Highlighting')
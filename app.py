@@ -12,6 +12,8 @@ import os
 import sys
 import time
 import json
+import shutil
+import tempfile
 import cv2
 from PIL import Image
 import numpy as np
@@ -21,6 +23,81 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from unified_intelligent_defect_analyzer import UnifiedIntelligentDefectAnalyzer
+from advanced_defect_highlighter import JPEG_QUALITY
+
+# Optional: orjson serializes reports several times faster and handles numpy natively
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Thickness category (as shown in the UI) -> numerical thickness in mm
+_THICKNESS_MAP = {
+    "1/8 in (3.2mm)": 3.2,
+    "1/4 in (6.4mm)": 6.4,
+    "3/8 in (9.5mm)": 9.5,
+    "1/2 in (12.7mm)": 12.7,
+    "5/8 in (15.9mm)": 15.9,
+    "3/4 in (19.1mm)": 19.1,
+    "7/8 in (22.2mm)": 22.2,
+    "1 in (25.4mm)": 25.4,
+    "1-1/4 in (31.8mm)": 31.8,
+    "1-1/2 in (38.1mm)": 38.1,
+    "2 in (50.8mm)": 50.8,
+    "3 in (76.2mm)": 76.2
+}
+
+# Metal type (as shown in the UI) -> analyzer metal type key
+_METAL_TYPE_NORMALIZED = {
+    "Carbon Steel": "carbon_steel",
+    "Stainless Steel": "stainless_steel",
+    "Aluminum": "aluminum",
+    "Alloy Steel": "alloy_steel"
+}
+
+# Download files are written under here; created once at import
+Path("downloads").mkdir(exist_ok=True)
+
+# Per-request download folders older than this are removed (seconds)
+_DOWNLOAD_TTL_SECONDS = 60 * 60
+
+# Longest side uploads are downscaled to before analysis
+_MAX_UPLOAD_DIM = 1280
+
+# Static parts of the web report, built once at import
+_REPORT_HEADER_HTML = """
+        <div style="font-family: 'Segoe UI', Arial, sans-serif; line-height: 1.6;">
+          <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; border-radius: 10px; margin-bottom: 20px; text-align: center;">
+            <h2>🔬 Metal Defect Analysis Results</h2>
+            <p>Unified Intelligent Defect Analysis Results</p>
+        </div>
+        """
+
+_DEFECT_CARD_HTML = """
+                <div style="background: white; padding: 10px; margin: 5px 0; border-radius: 5px; border-left: 3px solid #007bff;">
+                    <strong>Defect #{i}:</strong> {type} (Confidence: {conf:.1f}%)
+                </div>
+                """
+
+_REPORT_FOOTER_HTML = """
+        <div style="text-align: center; color: #666; font-size: 12px; margin-top: 20px;">
+            <p>Generated by Unified Intelligent Defect Analyzer v4.0</p>
+            <p>Advanced Industrial-Grade Defect Analysis System</p>
+        </div>
+        </div>
+        """
+
+# Shared analyzer; built on first use so re-creating the interface
+# (e.g. on reload) does not load the models a second time
+_ANALYZER = None
+
+def _get_analyzer():
+    """Return the process-wide analyzer, creating it on first call"""
+    global _ANALYZER
+    if _ANALYZER is None:
+        _ANALYZER = UnifiedIntelligentDefectAnalyzer()
+    return _ANALYZER
 
 class WebInterface:
     """Professional web interface for the unified defect analysis system"""
@@ -34,7 +111,7 @@ class WebInterface:
         """Initialize the unified analysis system"""
         try:
             print("🚀 Initializing Unified Intelligent Defect Analysis System...")
-            self.analyzer = UnifiedIntelligentDefectAnalyzer()
+            self.analyzer = _get_analyzer()
             print("✅ System initialized successfully")
             return True
         except Exception as e:
@@ -62,30 +139,25 @@ class WebInterface:
             return None, "❌ System not initialized. Please refresh the page.", None
         
         try:
-            # Save uploaded image temporarily
-            progress(0.1, desc="Processing uploaded image...")
-            temp_image_path = "temp_uploaded_image.jpg"
-            image.save(temp_image_path)
-              # Prepare material parameters
-            progress(0.2, desc="Preparing analysis parameters...")
-              # Convert thickness category to numerical value for calculations
-            thickness_map = {
-                "1/8 in (3.2mm)": 3.2,
-                "1/4 in (6.4mm)": 6.4,
-                "3/8 in (9.5mm)": 9.5,
-                "1/2 in (12.7mm)": 12.7,
-                "5/8 in (15.9mm)": 15.9,
-                "3/4 in (19.1mm)": 19.1,
-                "7/8 in (22.2mm)": 22.2,
-                "1 in (25.4mm)": 25.4,
-                "1-1/4 in (31.8mm)": 31.8,
-                "1-1/2 in (38.1mm)": 38.1,
-                "2 in (50.8mm)": 50.8,
-                "3 in (76.2mm)": 76.2            }
+            # Hand the uploaded image to the analyzer in memory (PIL RGB -> OpenCV BGR)
+            # and prepare material parameters; both are quick, so report them once
+            progress(0.2, desc="Preparing image and analysis parameters...")
+            # Cap very large uploads (e.g. phone photos) at the working resolution;
+            # defect locations are reported in this resized coordinate space, so
+            # the analyzer gets the scale to measure defect sizes at full resolution
+            scale = min(1.0, _MAX_UPLOAD_DIM / max(image.width, image.height))
+            if scale < 1.0:
+                image = image.resize((int(image.width * scale), int(image.height * scale)),
+                                     Image.BILINEAR)
+            image_array = cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+            
+            metal_type_key = _METAL_TYPE_NORMALIZED.get(metal_type)
+            if metal_type_key is None:
+                metal_type_key = metal_type.lower().replace(' ', '_')
             
             material_params = {
-                'metal_type': metal_type.lower().replace(' ', '_'),
-                'thickness': thickness_map.get(thickness, 6.4),  # Default to 1/4 in
+                'metal_type': metal_type_key,
+                'thickness': _THICKNESS_MAP.get(thickness, 6.4),  # Default to 1/4 in
                 'thickness_category': thickness,  # Keep original category for display
                 'quality_grade': quality_grade
             }
@@ -93,23 +165,20 @@ class WebInterface:
             # Run the unified analysis
             progress(0.4, desc="Running intelligent defect analysis...")
             result = self.analyzer.analyze_image_unified(
-                image_path=temp_image_path,
+                image_array=image_array,
                 metal_type=material_params['metal_type'],
                 thickness=material_params['thickness'],
                 quality_grade=material_params['quality_grade'],
-                enable_grid_analysis=True
+                enable_grid_analysis=True,
+                image_scale=scale
             )
             
-            # Generate highlighted image
-            progress(0.7, desc="Generating highlighted defect visualization...")
-            highlighted_image_path = None
+            # Highlighted image goes to Gradio as an RGB array, no file round-trip
+            display_image = None
             if hasattr(result, 'yellow_highlighted_image') and result.yellow_highlighted_image is not None:
-                # Save the highlighted numpy array as image file
-                import cv2
-                highlighted_image_path = "temp_highlighted_defects.jpg"
-                cv2.imwrite(highlighted_image_path, result.yellow_highlighted_image)
+                display_image = cv2.cvtColor(result.yellow_highlighted_image, cv2.COLOR_BGR2RGB)
             elif os.path.exists("highlighted_defects.jpg"):
-                highlighted_image_path = "highlighted_defects.jpg"
+                display_image = Image.open("highlighted_defects.jpg")
             
             # Generate comprehensive report
             progress(0.9, desc="Generating professional report...")
@@ -118,17 +187,6 @@ class WebInterface:
             # Prepare download files
             download_files = self.prepare_download_files(result)
             
-            progress(1.0, desc="Analysis complete!")
-            
-            # Load highlighted image for display
-            display_image = None
-            if highlighted_image_path and os.path.exists(highlighted_image_path):
-                display_image = Image.open(highlighted_image_path)
-              # Cleanup temp files
-            if os.path.exists(temp_image_path):
-                os.remove(temp_image_path)
-            # Don't remove the highlighted image yet - it's needed for display
-            
             return display_image, report, download_files
             
         except Exception as e:
@@ -150,14 +208,9 @@ class WebInterface:
         # Get professional report if available
         professional_report = getattr(result, 'professional_report', {})
         
-        # Generate HTML report
-        html_report = f"""
-        <div style="font-family: 'Segoe UI', Arial, sans-serif; line-height: 1.6;">
-          <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px; border-radius: 10px; margin-bottom: 20px; text-align: center;">
-            <h2>🔬 Metal Defect Analysis Results</h2>
-            <p>Unified Intelligent Defect Analysis Results</p>
-        </div>
-        
+        # Generate HTML report: collect fragments and join once at the end
+        parts = [_REPORT_HEADER_HTML]
+        parts.append(f"""
         <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 15px; margin-bottom: 20px;">
             <div style="background: #f8f9fa; padding: 15px; border-radius: 8px; border-left: 4px solid #28a745;">
                 <h3 style="margin: 0; color: #28a745;">Defects Detected</h3>
@@ -172,110 +225,134 @@ class WebInterface:
                 <p style="font-size: 18px; font-weight: bold; margin: 5px 0;">{pixels_highlighted:,}</p>
             </div>
         </div>
-        """
-          # Add material parameters
+        """)
+        
+        # Add material parameters
         thickness_display = material_params.get('thickness_category', material_params.get('thickness', 'Not specified'))
-        html_report += f"""        <div style="background: #e8f4fd; padding: 15px; border-radius: 8px; margin-bottom: 20px;">
+        parts.append(f"""        <div style="background: #e8f4fd; padding: 15px; border-radius: 8px; margin-bottom: 20px;">
             <h3 style="color: #0056b3;">Material Parameters</h3>
             <p><strong>Metal Type:</strong> {material_params.get('metal_type', 'Not specified').replace('_', ' ').title()}</p>
             <p><strong>Thickness Category:</strong> {thickness_display}</p>
             <p><strong>Quality Grade:</strong> Grade {material_params.get('quality_grade', 'Not specified')}</p>
         </div>
-        """
+        """)
         
         # Add executive summary if available
         if professional_report and 'executive_summary' in professional_report:
             executive_summary = professional_report['executive_summary']
-            html_report += f"""            <div style="background: #fff3cd; padding: 15px; border-radius: 8px; margin-bottom: 20px; border-left: 4px solid #856404;">
+            parts.append(f"""            <div style="background: #fff3cd; padding: 15px; border-radius: 8px; margin-bottom: 20px; border-left: 4px solid #856404;">
                 <h3 style="color: #856404;">Executive Summary</h3>
                 <pre style="white-space: pre-wrap; font-family: inherit; background: white; padding: 10px; border-radius: 5px;">{executive_summary}</pre>
             </div>
-            """
+            """)
         
-        # Add detailed findings        if hasattr(result, 'classified_defects') and result.classified_defects:
-            html_report += """
+        # Add detailed findings
+        if hasattr(result, 'classified_defects') and result.classified_defects:
+            parts.append("""
             <div style="background: #f8f9fa; padding: 15px; border-radius: 8px; margin-bottom: 20px;">
                 <h3 style="color: #495057;">Identified Defects</h3>
-            """
-            for i, defect in enumerate(result.classified_defects, 1):
-                defect_type = defect.get('type', 'Unknown')
-                confidence = defect.get('confidence', 0) * 100
-                html_report += f"""
-                <div style="background: white; padding: 10px; margin: 5px 0; border-radius: 5px; border-left: 3px solid #007bff;">
-                    <strong>Defect #{i}:</strong> {defect_type} (Confidence: {confidence:.1f}%)
-                </div>
-                """
-            html_report += "</div>"
+            """)
+            parts.append("".join(
+                _DEFECT_CARD_HTML.format(i=i, type=defect.get('type', 'Unknown'),
+                                         conf=defect.get('confidence', 0) * 100)
+                for i, defect in enumerate(result.classified_defects, 1)
+            ))
+            parts.append("</div>")
         
         # Add unknown defects if any
         if hasattr(result, 'unknown_defects') and result.unknown_defects:
-            html_report += f"""
+            parts.append(f"""
             <div style="background: #fff3cd; padding: 15px; border-radius: 8px; margin-bottom: 20px; border-left: 4px solid #856404;">
                 <h3 style="color: #856404;">Unknown Defects</h3>
                 <p>Found {len(result.unknown_defects)} defects that require manual expert inspection</p>
             </div>
-            """
+            """)
         
         # Add recommendations if available
         if professional_report and 'recommendations' in professional_report:
             recommendations = professional_report['recommendations']
-            html_report += """
+            parts.append("""
             <div style="background: #d1ecf1; padding: 15px; border-radius: 8px; margin-bottom: 20px; border-left: 4px solid #0c5460;">
                 <h3 style="color: #0c5460;">Recommendations</h3>
                 <ul>
-            """
-            for rec in recommendations:
-                html_report += f"<li>{rec}</li>"
-            html_report += "</ul></div>"
+            """)
+            parts.append("".join(f"<li>{rec}</li>" for rec in recommendations))
+            parts.append("</ul></div>")
         
         # Add ASTM compliance if available
         compliance_status = "Not tested"
         if hasattr(result, 'compliance_pass_fail'):
             compliance_status = "✅ Compliant" if result.compliance_pass_fail else "❌ Non-compliant"
         
-        html_report += f"""
+        parts.append(f"""
         <div style="background: #d4edda; padding: 15px; border-radius: 8px; margin-bottom: 20px; border-left: 4px solid #155724;">
             <h3 style="color: #155724;">ASTM E-1932 Standards Compliance</h3>
             <p style="font-size: 18px; font-weight: bold;">{compliance_status}</p>
         </div>
+        """)
+        parts.append(_REPORT_FOOTER_HTML)
         
-        <div style="text-align: center; color: #666; font-size: 12px; margin-top: 20px;">
-            <p>Generated by Unified Intelligent Defect Analyzer v4.0</p>
-            <p>Advanced Industrial-Grade Defect Analysis System</p>
-        </div>
-        </div>
-        """
-        
-        return html_report
+        return "".join(parts)
     
     def prepare_download_files(self, result):
         """Prepare downloadable files for the user"""
         download_files = []
+        request_dir = None
         
         try:
-            # Create downloads directory
-            os.makedirs("downloads", exist_ok=True)
+            # Each request gets its own folder so concurrent users never
+            # overwrite each other's files; expired ones are removed first
+            _prune_download_dirs()
+            request_dir = tempfile.mkdtemp(prefix="analysis_", dir="downloads")
             
             # Export JSON report
             if hasattr(result, 'professional_report'):
-                json_path = "downloads/defect_analysis_report.json"
-                with open(json_path, 'w', encoding='utf-8') as f:
-                    json.dump(result.professional_report, f, indent=2, ensure_ascii=False, default=str)
+                json_path = os.path.join(request_dir, "defect_analysis_report.json")
+                if ORJSON_AVAILABLE:
+                    with open(json_path, 'wb') as f:
+                        f.write(orjson.dumps(
+                            result.professional_report,
+                            option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+                            default=str
+                        ))
+                else:
+                    with open(json_path, 'w', encoding='utf-8') as f:
+                        json.dump(result.professional_report, f, indent=2, ensure_ascii=False, default=str)
                 download_files.append(json_path)
             
-            # Copy highlighted image
-            if hasattr(result, 'highlighted_image_path') and result.highlighted_image_path:
-                if os.path.exists(result.highlighted_image_path):
-                    import shutil
-                    download_path = "downloads/highlighted_defects.jpg"
-                    shutil.copy2(result.highlighted_image_path, download_path)
+            # Encode the highlighted image once, straight into the downloads dir
+            if getattr(result, 'yellow_highlighted_image', None) is not None:
+                download_path = os.path.join(request_dir, "highlighted_defects.jpg")
+                ok, encoded = cv2.imencode(".jpg", result.yellow_highlighted_image,
+                                           [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                if ok:
+                    encoded.tofile(download_path)
                     download_files.append(download_path)
             
         except Exception as e:
             print(f"Error preparing download files: {e}")
+            # Don't leave half-written files behind
+            if request_dir:
+                shutil.rmtree(request_dir, ignore_errors=True)
+            download_files = []
         
         return download_files if download_files else None
 
+def _prune_download_dirs(max_age: float = _DOWNLOAD_TTL_SECONDS):
+    """Remove per-request download folders older than max_age seconds"""
+    cutoff = time.time() - max_age
+    try:
+        entries = list(os.scandir("downloads"))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if (entry.name.startswith("analysis_") and entry.is_dir()
+                    and entry.stat().st_mtime < cutoff):
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            continue  # Removed concurrently by another request
+
 def create_interface():
     """Create and configure the Gradio interface"""    
     # Initialize web interface
@@ -327,17 +404,12 @@ def create_interface():
                     gr.HTML("<h4>Material Parameters</h4>")
                     
                     metal_type = gr.Dropdown(
-                        choices=["Carbon Steel", "Stainless Steel", "Aluminum", "Alloy Steel"],
+                        choices=list(_METAL_TYPE_NORMALIZED),
                         label="Metal Type",                        value="Carbon Steel"
                     )
                     
                     thickness = gr.Dropdown(
-                        choices=[
-                            "1/8 in (3.2mm)", "1/4 in (6.4mm)", "3/8 in (9.5mm)", 
-                            "1/2 in (12.7mm)", "5/8 in (15.9mm)", "3/4 in (19.1mm)",
-                            "7/8 in (22.2mm)", "1 in (25.4mm)", "1-1/4 in (31.8mm)",
-                            "1-1/2 in (38.1mm)", "2 in (50.8mm)", "3 in (76.2mm)"
-                        ],
+                        choices=list(_THICKNESS_MAP),
                         label="Thickness Category",
                         value="1/4 in (6.4mm)"
                     )
@@ -408,6 +480,10 @@ def main():
     # Create and launch interface
     interface = create_interface()
     
+    # Queue concurrent requests server-side; the analyzer (and its YOLO model)
+    # is shared, so requests are served in order rather than contending for it
+    interface.queue(max_size=32)
+    
     # Launch with appropriate settings
     interface.launch(
         server_name="0.0.0.0",
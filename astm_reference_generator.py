@@ -4,6 +4,7 @@ Generates reference images and cards for ASTM standards compliance
 """
 
 import cv2
+import functools
 import numpy as np
 from typing import Dict, List, Tuple, Optional, Any
 from dataclasses import dataclass
@@ -23,14 +24,115 @@ class ReferenceCard:
     standards_reference: str
     creation_date: str
 
+class _CardTable:
+    """Columnar store of reference cards: scalar metadata in parallel arrays, cards in a list"""
+    __slots__ = ('keys', 'metal', 'grade', 't_lo', 't_hi', 'cards', '_key_to_idx', '_size')
+    
+    def __init__(self, capacity: int = 16):
+        self.keys: List[Tuple[str, str, int]] = []
+        self.cards: List[ReferenceCard] = []
+        self.metal = np.empty(capacity, dtype=object)
+        self.grade = np.empty(capacity, dtype=object)
+        self.t_lo = np.empty(capacity, dtype=np.float32)
+        self.t_hi = np.empty(capacity, dtype=np.float32)
+        self._key_to_idx: Dict[Tuple[str, str, int], int] = {}
+        self._size = 0
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def __contains__(self, key: Tuple[str, str, int]) -> bool:
+        return key in self._key_to_idx
+    
+    def get(self, key: Tuple[str, str, int]) -> Optional[ReferenceCard]:
+        idx = self._key_to_idx.get(key)
+        return None if idx is None else self.cards[idx]
+    
+    def add(self, key: Tuple[str, str, int], card: ReferenceCard):
+        """Insert a card, replacing any card with the same key"""
+        idx = self._key_to_idx.get(key)
+        if idx is None:
+            idx = self._size
+            if idx == len(self.t_lo):
+                self._grow()
+            self.keys.append(key)
+            self.cards.append(card)
+            self._key_to_idx[key] = idx
+            self._size += 1
+        else:
+            self.cards[idx] = card
+        
+        self.metal[idx] = card.metal_type
+        self.grade[idx] = card.quality_grade
+        self.t_lo[idx], self.t_hi[idx] = card.thickness_range
+    
+    def find(self, metal_type: str, quality_grade: str, thickness: float) -> List[ReferenceCard]:
+        """All cards for a metal/grade whose thickness range covers the given thickness"""
+        n = self._size
+        matches = np.flatnonzero(
+            (self.metal[:n] == metal_type) & (self.grade[:n] == quality_grade) &
+            (self.t_lo[:n] <= thickness) & (self.t_hi[:n] >= thickness)
+        )
+        return [self.cards[i] for i in matches.tolist()]
+    
+    def _grow(self):
+        """Double the capacity of the metadata columns"""
+        capacity = max(1, 2 * len(self.t_lo))
+        for name in ('metal', 'grade', 't_lo', 't_hi'):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+
+# Fill color of the synthetic acceptable defects (BGR)
+_DEFECT_COLOR = (50, 50, 50)
+
+def _card_key(metal_type: str, quality_grade: str, thickness: float) -> Tuple[str, str, int]:
+    """Card store key; thickness in tenths of a mm, matching the card id's 0.1mm precision"""
+    return (metal_type, quality_grade, int(round(thickness * 10)))
+
+@functools.lru_cache(maxsize=8)
+def _base_surface(metal_type: str, height: int = 400, width: int = 600) -> np.ndarray:
+    """Noisy base metal surface for a metal type; computed once and shared (read-only)"""
+    
+    # Create base metal surface
+    if metal_type == 'steel':
+        base_color = (100, 100, 120)  # Steel gray
+    elif metal_type == 'aluminum':
+        base_color = (200, 200, 200)  # Aluminum silver
+    elif metal_type == 'copper':
+        base_color = (80, 120, 180)   # Copper brownish
+    else:
+        base_color = (128, 128, 128)  # Default gray
+    
+    # Base color plus metal texture: OpenCV draws int16 Gaussian noise and
+    # adds the color as a scalar, saturating straight into the uint8 output
+    # (no float intermediate and no separate fill pass)
+    noise = np.empty((height, width, 3), dtype=np.int16)
+    cv2.randn(noise, (0, 0, 0), (10, 10, 10))  # Per-channel; a bare scalar only fills channel 0
+    surface = np.empty((height, width, 3), dtype=np.uint8)
+    cv2.add(noise, base_color + (0,), dst=surface, dtype=cv2.CV_8U)  # 4-tuple -> cv::Scalar
+    surface.setflags(write=False)
+    return surface
+
 class ASTMReferenceGenerator:
-    """Generator for ASTM standard reference images and cards"""
+    """
+    Generator for ASTM standard reference images and cards.
+    
+    The textured base surface depends only on the metal type, so it is
+    synthesized once per metal (see _base_surface) and shared by every
+    generator; each reference image only composites its defects on a copy.
+    """
     
-    def __init__(self):
-        """Initialize the ASTM reference generator"""
-        self.reference_cards = {}
+    def __init__(self, seed: Optional[int] = None, output_dir: str = "reference_cards"):
+        """Initialize the ASTM reference generator (seed makes defect placement reproducible)"""
+        self.output_dir = output_dir
+        self.reference_cards = _CardTable()
         self.standards_db = self._initialize_standards_db()
         
+        # Per-instance PCG64 generator: no shared global RNG state between generators
+        self._rng = np.random.default_rng(seed)
+    
     def _initialize_standards_db(self) -> Dict[str, Any]:
         """Initialize the standards database"""
         return {
@@ -89,31 +191,14 @@ class ASTMReferenceGenerator:
             creation_date="2025-06-20"
         )
         
-        self.reference_cards[card_id] = reference_card
+        self.reference_cards.add(_card_key(metal_type, quality_grade, thickness), reference_card)
         return reference_card
     
     def _create_reference_image(self, metal_type: str, quality_grade: str, thickness: float) -> np.ndarray:
         """Create a synthetic reference image"""
         
-        # Base image dimensions
-        height, width = 400, 600
-        
-        # Create base metal surface
-        if metal_type == 'steel':
-            base_color = (100, 100, 120)  # Steel gray
-        elif metal_type == 'aluminum':
-            base_color = (200, 200, 200)  # Aluminum silver
-        elif metal_type == 'copper':
-            base_color = (80, 120, 180)   # Copper brownish
-        else:
-            base_color = (128, 128, 128)  # Default gray
-        
-        # Create base image
-        image = np.full((height, width, 3), base_color, dtype=np.uint8)
-        
-        # Add metal texture
-        noise = np.random.normal(0, 10, (height, width, 3))
-        image = np.clip(image + noise, 0, 255).astype(np.uint8)
+        # Copy of the cached textured surface for this metal
+        image = _base_surface(metal_type).copy()
         
         # Add acceptable defects based on quality grade
         if quality_grade in self.standards_db.get(metal_type, {}).get('allowable_defects', {}):
@@ -131,19 +216,20 @@ class ASTMReferenceGenerator:
         height, width = image.shape[:2]
         
         # Add some acceptable defects
-        num_defects = min(max_count, np.random.randint(0, max_count + 1))
-        
-        for _ in range(num_defects):
-            # Random position
-            x = np.random.randint(int(max_size * 20), width - int(max_size * 20))
-            y = np.random.randint(int(max_size * 20), height - int(max_size * 20))
-            
-            # Random size within acceptable range
-            size = np.random.uniform(max_size * 0.3, max_size)
-            radius = int(size * 10)  # Convert to pixels
-            
-            # Add small defect
-            cv2.circle(image, (x, y), radius, (50, 50, 50), -1)
+        num_defects = int(self._rng.integers(0, max_count + 1))
+        if num_defects == 0:
+            return
+        
+        # Draw all positions and sizes at once
+        margin = int(max_size * 20)
+        xs = self._rng.integers(margin, width - margin, size=num_defects)
+        ys = self._rng.integers(margin, height - margin, size=num_defects)
+        sizes = self._rng.uniform(max_size * 0.3, max_size, size=num_defects)
+        radii = (sizes * 10).astype(np.int32)  # Convert to pixels
+        
+        # Add small defects (plain ints avoid numpy scalar boxing per call)
+        for x, y, radius in zip(xs.tolist(), ys.tolist(), radii.tolist()):
+            cv2.circle(image, (x, y), radius, _DEFECT_COLOR, thickness=-1, lineType=cv2.LINE_4)
     
     def _generate_defect_examples(self, metal_type: str, quality_grade: str) -> List[Dict[str, Any]]:
         """Generate examples of acceptable defects"""
@@ -169,15 +255,26 @@ class ASTMReferenceGenerator:
         
         return examples
     
+    def save_reference_card(self, card: ReferenceCard, filename: str) -> str:
+        """Write a card's reference image to output_dir; returns its path"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        card_path = os.path.join(self.output_dir, filename)
+        if not cv2.imwrite(card_path, card.reference_image):
+            raise IOError(f"Could not write reference card: {card_path}")
+        return card_path
+    
     def get_reference_card(self, metal_type: str, quality_grade: str, thickness: float) -> Optional[ReferenceCard]:
         """Get or generate a reference card"""
         
-        card_id = f"{metal_type}_{quality_grade}_{thickness:.1f}mm"
-        
-        if card_id not in self.reference_cards:
+        card = self.reference_cards.get(_card_key(metal_type, quality_grade, thickness))
+        if card is None:
             return self.generate_reference_card(metal_type, quality_grade, thickness)
         
-        return self.reference_cards[card_id]
+        return card
+    
+    def find_reference_cards(self, metal_type: str, quality_grade: str, thickness: float) -> List[ReferenceCard]:
+        """Existing cards for a metal and grade whose thickness range covers the given thickness"""
+        return self.reference_cards.find(metal_type, quality_grade, thickness)
     
     def compare_with_reference(self, 
                              test_image: np.ndarray, 
@@ -202,15 +299,15 @@ class ASTMReferenceGenerator:
         defect_count = len(detected_defects)
         max_defect_size = 0
         
-        for defect in detected_defects:
-            # Estimate defect size from bounding box
-            bbox = defect.get('bbox', [0, 0, 10, 10])
-            if len(bbox) >= 4:
-                width = abs(bbox[2] - bbox[0])
-                height = abs(bbox[3] - bbox[1])
-                # Convert pixels to approximate mm (rough estimation)
-                size_mm = max(width, height) * 0.1  # Assuming 10 pixels = 1mm
-                max_defect_size = max(max_defect_size, size_mm)
+        # Estimate defect sizes from all bounding boxes at once
+        bboxes = [bbox[:4] for bbox in (defect.get('bbox', [0, 0, 10, 10]) for defect in detected_defects)
+                  if len(bbox) >= 4]
+        if bboxes:
+            bboxes = np.asarray(bboxes, dtype=np.float64)
+            extents = np.abs(bboxes[:, 2:4] - bboxes[:, 0:2])
+            # Convert pixels to approximate mm (rough estimation)
+            sizes_mm = extents.max(axis=1) * 0.1  # Assuming 10 pixels = 1mm
+            max_defect_size = float(sizes_mm.max())
         
         # Check compliance
         count_ok = defect_count <= allowable_params['max_count']
@@ -4,11 +4,16 @@ Implements professional quality control standards for metal defect analysis
 """
 
 import json
+import operator
 import sqlite3
-from typing import Dict, List, Optional, Tuple, Any
+import threading
+import numpy as np
+from typing import Dict, List, NamedTuple, Optional, Tuple, Any
 from dataclasses import dataclass, asdict
 from enum import Enum
 
+from perf_helpers import njit, thread_connection, transaction
+
 class MetalType(Enum):
     """Supported metal types per ASTM E-1932"""
     CARBON_STEEL = "Carbon Steel"
@@ -29,9 +34,18 @@ class PassFailResult(Enum):
     MARGINAL = "MARGINAL"
     FAIL = "FAIL"
 
-@dataclass
-class ASTMStandards:
-    """ASTM E-1932 standards lookup data"""
+@njit("float64[:](float64[:, :], float64)", cache=True)
+def _sizes_from_bboxes(bboxes, pixels_per_mm):
+    """Maximum bbox dimension divided by the calibration factor, for (N, 4) boxes"""
+    widths = bboxes[:, 2] - bboxes[:, 0]
+    heights = bboxes[:, 3] - bboxes[:, 1]
+    return np.maximum(widths, heights) / pixels_per_mm
+
+# determine_pass_fail_batch result codes -> PassFailResult
+_PASS_FAIL_BY_CODE = (PassFailResult.PASS, PassFailResult.MARGINAL, PassFailResult.FAIL)
+
+class ASTMStandards(NamedTuple):
+    """ASTM E-1932 standards lookup data (immutable, tuple-backed)"""
     metal_type: MetalType
     thickness_min: float  # inches
     thickness_max: float  # inches
@@ -74,6 +88,26 @@ class ASTMStandardsManager:
     
     def __init__(self):
         self.standards_table = self._initialize_standards_table()
+        self._initialize_limit_tables()
+    
+    def _initialize_limit_tables(self):
+        """Build the (metal type, grade) limit lookups from the standards table"""
+        # (metal, grade) float array, rows/columns in enum order, for batch pass/fail
+        self._metal_idx = {metal_type: i for i, metal_type in enumerate(self.standards_table)}
+        self._grade_idx = {grade: i for i, grade in enumerate(QualityGrade)}
+        self._limit_lut = np.array([
+            [standards.grade_a_limit, standards.grade_b_limit, standards.grade_c_limit, standards.grade_d_limit]
+            for standards in self.standards_table.values()
+        ], dtype=np.float64)
+        
+        # Flat dict view of the same table for single lookups; a Python dict hit
+        # is cheaper than indexing a NumPy array and converting the scalar back
+        limits = self._limit_lut.tolist()
+        self._grade_limits = {
+            (metal_type, grade): limits[i][j]
+            for metal_type, i in self._metal_idx.items()
+            for grade, j in self._grade_idx.items()
+        }
     
     def _initialize_standards_table(self) -> Dict[MetalType, ASTMStandards]:
         """Initialize the ASTM E-1932 standards lookup table"""
@@ -122,18 +156,11 @@ class ASTMStandardsManager:
     
     def get_grade_limit(self, metal_type: MetalType, grade: QualityGrade) -> float:
         """Get the defect size limit for a specific metal type and grade"""
-        standards = self.get_standards(metal_type)
-        
-        if grade == QualityGrade.GRADE_A:
-            return standards.grade_a_limit
-        elif grade == QualityGrade.GRADE_B:
-            return standards.grade_b_limit
-        elif grade == QualityGrade.GRADE_C:
-            return standards.grade_c_limit
-        elif grade == QualityGrade.GRADE_D:
-            return standards.grade_d_limit
-        else:
+        limit = self._grade_limits.get((metal_type, grade))
+        if limit is None:
+            self.get_standards(metal_type)  # Unknown metal type raises KeyError
             raise ValueError(f"Unknown grade: {grade}")
+        return limit
     
     def validate_thickness(self, metal_type: MetalType, thickness: float) -> bool:
         """Check if thickness is within ASTM standard range for metal type"""
@@ -162,6 +189,33 @@ class ASTMStandardsManager:
         
         return result, confidence
     
+    def determine_pass_fail_batch(self,
+                                  defect_sizes_inches,
+                                  metal_types,
+                                  required_grades) -> Tuple[List[PassFailResult], np.ndarray]:
+        """
+        Vectorized determine_pass_fail for many defects at once.
+        metal_types / required_grades may be a single value or one per defect.
+        Returns (results, confidence_scores)
+        """
+        sizes = np.atleast_1d(np.asarray(defect_sizes_inches, dtype=np.float64))
+        metal_idx = self._encode(metal_types, self._metal_idx)
+        grade_idx = self._encode(required_grades, self._grade_idx)
+        limits = self._limit_lut[metal_idx, grade_idx]
+        
+        # 0 = PASS, 1 = MARGINAL (within 20% tolerance), 2 = FAIL
+        codes = np.where(sizes <= limits, 0, np.where(sizes <= limits * 1.2, 1, 2))
+        confidences = np.where(codes == 1, 0.7, 1.0)
+        
+        return [_PASS_FAIL_BY_CODE[code] for code in codes.tolist()], confidences
+    
+    @staticmethod
+    def _encode(values, index: Dict[Enum, int]):
+        """Map an enum value (or a sequence of them) to lookup-table indices"""
+        if isinstance(values, Enum):
+            return index[values]
+        return np.fromiter((index[value] for value in values), dtype=np.intp)
+    
     def calculate_defect_size_mm(self, bbox: List[float], pixels_per_mm: float) -> float:
         """Calculate defect size in millimeters from bounding box"""
         x1, y1, x2, y2 = bbox
@@ -170,6 +224,11 @@ class ASTMStandardsManager:
         max_dimension_pixels = max(width_pixels, height_pixels)
         return max_dimension_pixels / pixels_per_mm
     
+    def calculate_defect_sizes_mm(self, bboxes, pixels_per_mm: float) -> np.ndarray:
+        """Vectorized calculate_defect_size_mm for an (N, 4) array of [x1, y1, x2, y2] boxes"""
+        bboxes = np.ascontiguousarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        return _sizes_from_bboxes(bboxes, float(pixels_per_mm))
+    
     def mm_to_inches(self, size_mm: float) -> float:
         """Convert millimeters to inches"""
         return size_mm / 25.4
@@ -218,17 +277,48 @@ class ASTMStandardsManager:
         
         return report
 
+_INSERT_ENHANCED_DETECTION_SQL = """
+    INSERT INTO enhanced_defect_detections 
+    (timestamp, image_hash, defect_type, confidence, 
+     bbox_x1, bbox_y1, bbox_x2, bbox_y2, 
+     defect_size_pixels, defect_size_mm, defect_size_inches,
+     image_width, image_height, model_version,
+     metal_type, thickness_inches, required_grade, pixels_per_mm,
+     standards_compliance, applicable_limit_inches, compliance_confidence,
+     user_feedback, is_verified)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Row assembly helpers for the insert hot path: one C-level attribute fetch
+# per detection, and enum -> stored string without per-row .value calls
+_detection_fields = operator.attrgetter(
+    'timestamp', 'image_hash', 'defect_type', 'confidence', 'bbox',
+    'defect_size_pixels', 'defect_size_mm', 'defect_size_inches', 'image_size', 'model_version',
+    'metal_type', 'thickness_inches', 'required_grade', 'pixels_per_mm',
+    'standards_compliance', 'applicable_limit_inches', 'compliance_confidence',
+    'user_feedback', 'is_verified'
+)
+_ENUM_VALUES = {member: member.value for enum in (MetalType, QualityGrade, PassFailResult) for member in enum}
+
 class EnhancedMemoryBank:
     """Enhanced Memory Bank with ASTM standards integration"""
     
     def __init__(self, db_path: str = "enhanced_memory_bank.db"):
         self.db_path = db_path
         self.standards_manager = ASTMStandardsManager()
+        
+        # One warm connection per thread (see _conn)
+        self._local = threading.local()
+        
         self.init_enhanced_database()
     
+    def _conn(self) -> sqlite3.Connection:
+        """This thread's long-lived connection (see perf_helpers.thread_connection)"""
+        return thread_connection(self._local, self.db_path)
+    
     def init_enhanced_database(self):
         """Initialize enhanced database with ASTM standards tables"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             cursor = conn.cursor()
             
             # Enhanced defect detections table with ASTM fields
@@ -297,42 +387,55 @@ class EnhancedMemoryBank:
                 )
             """)
             
-            conn.commit()
+            # Covering indexes for get_compliance_statistics' GROUP BY scans
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_compliance
+                ON enhanced_defect_detections (standards_compliance)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_metal_compliance
+                ON enhanced_defect_detections (metal_type, standards_compliance)
+            """)
     
     def store_enhanced_detection(self, detection: EnhancedDefectDetection) -> int:
         """Store enhanced defect detection with ASTM standards data"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO enhanced_defect_detections 
-                (timestamp, image_hash, defect_type, confidence, 
-                 bbox_x1, bbox_y1, bbox_x2, bbox_y2, 
-                 defect_size_pixels, defect_size_mm, defect_size_inches,
-                 image_width, image_height, model_version,
-                 metal_type, thickness_inches, required_grade, pixels_per_mm,
-                 standards_compliance, applicable_limit_inches, compliance_confidence,
-                 user_feedback, is_verified)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                detection.timestamp, detection.image_hash, detection.defect_type,
-                detection.confidence, detection.bbox[0], detection.bbox[1],
-                detection.bbox[2], detection.bbox[3], detection.defect_size_pixels,
-                detection.defect_size_mm, detection.defect_size_inches,
-                detection.image_size[0], detection.image_size[1], detection.model_version,
-                detection.metal_type.value if detection.metal_type else None,
-                detection.thickness_inches, 
-                detection.required_grade.value if detection.required_grade else None,
-                detection.pixels_per_mm, 
-                detection.standards_compliance.value if detection.standards_compliance else None,
-                detection.applicable_limit_inches, detection.compliance_confidence,
-                detection.user_feedback, detection.is_verified
-            ))
-            conn.commit()
+            cursor.execute(_INSERT_ENHANCED_DETECTION_SQL, self._detection_row(detection))
             return cursor.lastrowid
     
+    def store_enhanced_detections_batch(self, detections: List[EnhancedDefectDetection]) -> int:
+        """Store many enhanced detections in a single transaction; returns rows written"""
+        rows = [self._detection_row(detection) for detection in detections]
+        if not rows:
+            return 0
+        
+        with transaction(self._conn()) as cursor:
+            cursor.executemany(_INSERT_ENHANCED_DETECTION_SQL, rows)
+        return len(rows)
+    
+    @staticmethod
+    def _detection_row(detection: EnhancedDefectDetection) -> Tuple:
+        """Flatten a detection into the enhanced_defect_detections column order"""
+        (timestamp, image_hash, defect_type, confidence, bbox,
+         size_pixels, size_mm, size_inches, image_size, model_version,
+         metal_type, thickness_inches, required_grade, pixels_per_mm,
+         compliance, limit_inches, compliance_confidence,
+         user_feedback, is_verified) = _detection_fields(detection)
+        enum_value = _ENUM_VALUES.get  # None stays None
+        return (
+            timestamp, image_hash, defect_type, confidence,
+            bbox[0], bbox[1], bbox[2], bbox[3],
+            size_pixels, size_mm, size_inches,
+            image_size[0], image_size[1], model_version,
+            enum_value(metal_type), thickness_inches, enum_value(required_grade), pixels_per_mm,
+            enum_value(compliance), limit_inches, compliance_confidence,
+            user_feedback, is_verified
+        )
+    
     def get_compliance_statistics(self) -> Dict[str, Any]:
         """Get ASTM compliance statistics"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             cursor = conn.cursor()
             
             # Overall compliance rates
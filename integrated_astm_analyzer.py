@@ -7,8 +7,13 @@ import cv2
 import numpy as np
 from typing import Dict, List, Tuple, Optional, Any
 from dataclasses import dataclass
+from functools import cached_property
 import os
+import re
 import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 # Import all our systems
@@ -16,10 +21,45 @@ from astm_standards import (
     ASTMStandardsManager, MetalType, QualityGrade, 
     EnhancedDefectDetection, PassFailResult
 )
-from astm_reference_generator import ASTMReferenceGenerator
-from reference_image_system import ReferenceImageManager
-from max_recall_detector import MaxRecallDefectDetector
-from visual_similarity_scorer import VisualSimilarityScorer
+
+# Defect types whose every instance passes at no more than this fraction of the
+# ASTM limit can't change the verdict, so they skip reference-card comparison
+_REFERENCE_SIZE_FRACTION = 0.5
+
+# Upper bound on threads used for per-defect-type reference comparison
+_MAX_REFERENCE_WORKERS = 8
+
+# ASTM metal type -> ASTMReferenceGenerator metal key (steels share one surface)
+_GENERATOR_METALS = {
+    MetalType.CARBON_STEEL: 'steel',
+    MetalType.STAINLESS_STEEL: 'steel',
+    MetalType.ALLOY_STEEL: 'steel',
+    MetalType.ALUMINUM: 'aluminum'
+}
+
+# Per-defect section of the comprehensive report
+_DEFECT_SECTION_TEMPLATE = """
+### Defect {i}: {defect_type}
+{icon} **Status:** {status}
+- **Size:** {size_mm:.2f}mm ({size_inches:.4f}")
+- **ASTM Limit:** {limit_inches:.4f}"
+- **Confidence:** {confidence:.2f}
+"""
+
+# Keywords in defect type names that map to process-specific recommendations
+_DEFECT_KEYWORD_RE = re.compile(r'crack|break|spot|oil|inclusion', re.IGNORECASE)
+
+# Quality score starting point for each overall compliance result
+_BASE_QUALITY_SCORES = {
+    PassFailResult.PASS: 85.0,
+    PassFailResult.MARGINAL: 65.0,
+    PassFailResult.FAIL: 35.0
+}
+
+_STATUS_ICONS = {
+    PassFailResult.PASS: "✅",
+    PassFailResult.MARGINAL: "⚠️"
+}
 
 @dataclass
 class IntegratedAnalysisResult:
@@ -47,28 +87,61 @@ class IntegratedASTMAnalyzer:
     """Main class that integrates all ASTM systems"""
     
     def __init__(self):
-        # Initialize all subsystems
-        self.detector = MaxRecallDefectDetector()
+        # Standards tables are cheap and needed by every analysis; the heavier
+        # subsystems below load on first use
         self.astm_manager = ASTMStandardsManager()
-        self.reference_generator = ASTMReferenceGenerator()
-        self.reference_manager = ReferenceImageManager()
-        self.similarity_scorer = VisualSimilarityScorer()
+        
+        # Reference cards prepared for similarity scoring, keyed by card path
+        self._reference_images: Dict[str, np.ndarray] = {}
+        # Card paths already known to exist, so repeat lookups skip the disk
+        self._reference_card_paths: Dict[Tuple[MetalType, str, QualityGrade], str] = {}
+        self._generator_lock = threading.Lock()
         
         print("🔧 Integrated ASTM Analyzer initialized")
         print("📊 All systems connected: Detection + Standards + References + Similarity Scoring")
     
+    @cached_property
+    def detector(self):
+        """Maximum recall detector (loads the model weights on first use)"""
+        from max_recall_detector import MaxRecallDefectDetector
+        return MaxRecallDefectDetector()
+    
+    @cached_property
+    def reference_generator(self):
+        """ASTM reference card generator"""
+        from astm_reference_generator import ASTMReferenceGenerator
+        return ASTMReferenceGenerator()
+    
+    @cached_property
+    def reference_manager(self):
+        """Reference image library"""
+        from reference_image_system import ReferenceImageManager
+        return ReferenceImageManager()
+    
+    @cached_property
+    def similarity_scorer(self):
+        """Visual similarity scorer, with its SSIM kernels compiled"""
+        from visual_similarity_scorer import VisualSimilarityScorer
+        scorer = VisualSimilarityScorer()
+        scorer.warm_up()
+        return scorer
+    
     def analyze_image_complete(self, 
                              image_path: str,
                              metal_type: MetalType,
                              thickness_inches: float,
                              required_grade: QualityGrade,
-                             pixels_per_mm: float = 10.0) -> IntegratedAnalysisResult:
+                             pixels_per_mm: float = 10.0,
+                             force_full_reference: bool = False) -> IntegratedAnalysisResult:
         """
         Complete integrated analysis:
         1. Detect defects with maximum recall
         2. Analyze against ASTM standards  
         3. Compare with reference cards
         4. Provide pass/fail determination
+        
+        Set force_full_reference=True (e.g. for audit runs) to compare every
+        defect type with its reference card, including clearly passing ones.
         """
         
         print(f"🔍 Starting integrated analysis for {metal_type.value}")
@@ -76,6 +149,57 @@ class IntegratedASTMAnalyzer:
         # Step 1: Detect all defects
         detection_results = self.detector.detect_all_defects(image_path, return_details=True)
         
+        return self._analyze_detections(
+            detection_results, image_path, metal_type, thickness_inches,
+            required_grade, pixels_per_mm, force_full_reference
+        )
+    
+    def analyze_images_complete(self,
+                                image_paths: List[str],
+                                metal_type: MetalType,
+                                thickness_inches: float,
+                                required_grade: QualityGrade,
+                                pixels_per_mm: float = 10.0,
+                                force_full_reference: bool = False,
+                                batch_size: int = 8) -> List[Optional[IntegratedAnalysisResult]]:
+        """
+        analyze_image_complete for many images of the same material: detection
+        runs as batched inference and the reference cards are loaded once for
+        the whole set. An image whose detection fails (e.g. an unreadable
+        file) gets None in its slot; the other images are unaffected.
+        """
+        
+        print(f"🔍 Starting integrated analysis of {len(image_paths)} images for {metal_type.value}")
+        
+        # Step 1: Detect all defects, batch_size images per forward pass
+        batch_detections = self.detector.detect_all_defects_batch(
+            image_paths, return_details=True, batch_size=batch_size
+        )
+        
+        results = []
+        for image_path, detection_results in zip(image_paths, batch_detections):
+            # Unreadable / undecodable inputs come back as per-image error entries
+            if 'error' in detection_results:
+                print(f"❌ Detection failed for {image_path}: {detection_results['error']}")
+                results.append(None)
+                continue
+            results.append(self._analyze_detections(
+                detection_results, image_path, metal_type, thickness_inches,
+                required_grade, pixels_per_mm, force_full_reference
+            ))
+        
+        return results
+    
+    def _analyze_detections(self,
+                            detection_results: Dict[str, Any],
+                            image_path: str,
+                            metal_type: MetalType,
+                            thickness_inches: float,
+                            required_grade: QualityGrade,
+                            pixels_per_mm: float,
+                            force_full_reference: bool) -> IntegratedAnalysisResult:
+        """Steps 2-5 of the integrated analysis for one image's detection results"""
+        
         if 'error' in detection_results:
             raise Exception(f"Detection failed: {detection_results['error']}")
         
@@ -84,42 +208,58 @@ class IntegratedASTMAnalyzer:
         
         print(f"✅ Step 1: Found {total_defects} defects")
         
-        # Step 2: ASTM Compliance Analysis
+        # Step 2: ASTM Compliance Analysis (all defects at once)
         compliance_details = []
         overall_compliance = PassFailResult.PASS
+        limit_inches = self.astm_manager.get_grade_limit(metal_type, required_grade)
         
-        for defect in detected_defects:
-            # Calculate defect size in real units
-            bbox = defect['bbox']
-            defect_size_pixels = max(bbox[2] - bbox[0], bbox[3] - bbox[1])
-            defect_size_mm = defect_size_pixels / pixels_per_mm
-            defect_size_inches = defect_size_mm / 25.4
+        if detected_defects:
+            # Calculate defect sizes in real units
+            sizes_mm = self.astm_manager.calculate_defect_sizes_mm(
+                [defect['bbox'] for defect in detected_defects], pixels_per_mm
+            )
+            sizes_inches = sizes_mm / 25.4
             
             # Check ASTM compliance
-            compliance_result, confidence = self.astm_manager.determine_pass_fail(
-                defect_size_inches, metal_type, required_grade
+            compliance_results, confidences = self.astm_manager.determine_pass_fail_batch(
+                sizes_inches, metal_type, required_grade
             )
             
-            # Update overall compliance
-            if compliance_result == PassFailResult.FAIL:
+            # Overall compliance is the worst individual result
+            if PassFailResult.FAIL in compliance_results:
                 overall_compliance = PassFailResult.FAIL
-            elif compliance_result == PassFailResult.MARGINAL and overall_compliance == PassFailResult.PASS:
+            elif PassFailResult.MARGINAL in compliance_results:
                 overall_compliance = PassFailResult.MARGINAL
             
-            compliance_details.append({
-                'defect_type': defect['class'],
-                'defect_size_mm': defect_size_mm,
-                'defect_size_inches': defect_size_inches,
-                'astm_limit_inches': self.astm_manager.get_grade_limit(metal_type, required_grade),
-                'compliance_result': compliance_result,
-                'compliance_confidence': confidence,
-                'bbox': bbox
-            })
+            compliance_details = [
+                {
+                    'defect_type': defect['class_name'],
+                    'defect_size_mm': size_mm,
+                    'defect_size_inches': size_inches,
+                    'astm_limit_inches': limit_inches,
+                    'compliance_result': compliance_result,
+                    'compliance_confidence': confidence,
+                    'bbox': defect['bbox']
+                }
+                for defect, size_mm, size_inches, compliance_result, confidence in zip(
+                    detected_defects, sizes_mm.tolist(), sizes_inches.tolist(),
+                    compliance_results, confidences.tolist()
+                )
+            ]
         
         print(f"✅ Step 2: ASTM compliance = {overall_compliance.value}")
-          # Step 3: Reference Card Comparison
+          # Step 3: Reference Card Comparison (only for types that could affect the verdict)
+        types_needing_ref = None
+        if not force_full_reference:
+            reference_threshold = _REFERENCE_SIZE_FRACTION * limit_inches
+            types_needing_ref = {
+                cd['defect_type'] for cd in compliance_details
+                if cd['compliance_result'] != PassFailResult.PASS
+                or cd['defect_size_inches'] > reference_threshold
+            }
         reference_analysis = self._compare_with_reference_cards(
-            detected_defects, metal_type, required_grade, image_path
+            detected_defects, metal_type, required_grade, image_path,
+            defect_types=types_needing_ref
         )
         
         print(f"✅ Step 3: Reference comparison completed")
@@ -138,7 +278,7 @@ class IntegratedASTMAnalyzer:
         result = IntegratedAnalysisResult(
             total_defects=total_defects,
             detected_defects=detected_defects,
-            detection_confidence_avg=detection_results['confidence_range']['avg'],
+            detection_confidence_avg=float(np.mean([d['confidence'] for d in detected_defects])) if detected_defects else 0.0,
             material_spec={
                 'metal_type': metal_type.value,
                 'thickness_inches': thickness_inches,
@@ -160,84 +300,154 @@ class IntegratedASTMAnalyzer:
                                     detected_defects: List[Dict],
                                     metal_type: MetalType, 
                                     required_grade: QualityGrade,
-                                    original_image_path: str = None) -> Dict:
-        """Compare detected defects with reference cards"""
+                                    original_image_path: str = None,
+                                    defect_types: Optional[set] = None) -> Dict:
+        """Compare detected defects with reference cards (restricted to defect_types if given)"""
         
         cards_used = []
         similarity_scores = {}
         
-        # For each unique defect type found
-        unique_defect_types = set(defect['class'] for defect in detected_defects)
+        # Group defects by type in one pass
+        defects_by_type: Dict[str, List[Dict]] = {}
+        for defect in detected_defects:
+            if defect_types is None or defect['class_name'] in defect_types:
+                defects_by_type.setdefault(defect['class_name'], []).append(defect)
+        
+        if not defects_by_type:
+            return {
+                'cards_used': cards_used,
+                'similarity_scores': similarity_scores
+            }
+        
+        # Decode the inspected image once for all defect types
+        original_image = None
+        if original_image_path and os.path.exists(original_image_path):
+            original_image = cv2.imread(original_image_path)
+        
+        # Nominal thickness for on-demand cards, looked up once for all types
+        standards = self.astm_manager.get_standards(metal_type)
+        reference_thickness = (standards.thickness_min + standards.thickness_max) / 2
+        
+        # Card file names differ only by defect type
+        card_name_template = (
+            f"{metal_type.value.replace(' ', '_')}_{{}}_{required_grade.value.replace(' ', '_')}.png"
+        )
+        
+        # Resolve the lazy subsystems here so worker threads don't race to create them
+        self.reference_generator, self.similarity_scorer
+        
+        # Each defect type is independent. Card I/O, preprocessing (OpenCV) and the
+        # serial nogil SSIM kernel all release the GIL, so types overlap across
+        # threads; the pool is the only source of parallelism on this path
+        results = {}
+        max_workers = min(_MAX_REFERENCE_WORKERS, len(defects_by_type))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    self._process_reference_type, defect_type, defects_of_type,
+                    metal_type, required_grade, reference_thickness, card_name_template,
+                    original_image
+                ): defect_type
+                for defect_type, defects_of_type in defects_by_type.items()
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        
+        # Collect in defect-type order so the output doesn't depend on thread timing
+        for defect_type in defects_by_type:
+            card_path, similarity_score = results[defect_type]
+            if card_path is not None:
+                cards_used.append(card_path)
+            if similarity_score is not None:
+                similarity_scores[defect_type] = similarity_score
         
-        for defect_type in unique_defect_types:
-            # Try to find or generate reference card
-            try:
-                # Check if reference card exists
+        return {
+            'cards_used': cards_used,
+            'similarity_scores': similarity_scores
+        }
+    
+    def _process_reference_type(self,
+                                defect_type: str,
+                                defects_of_type: List[Dict],
+                                metal_type: MetalType,
+                                required_grade: QualityGrade,
+                                reference_thickness: float,
+                                card_name_template: str,
+                                original_image: Optional[np.ndarray]) -> Tuple[Optional[str], Optional[float]]:
+        """Find or generate the reference card for one defect type and score its defects against it"""
+        
+        try:
+            # Check if reference card exists
+            card_key = (metal_type, defect_type, required_grade)
+            card_path = self._reference_card_paths.get(card_key)
+            if card_path is None:
                 card_path = os.path.join(
                     self.reference_generator.output_dir,
-                    f"{metal_type.value.replace(' ', '_')}_{defect_type}_{required_grade.value.replace(' ', '_')}.png"
+                    card_name_template.format(defect_type)
                 )
                 
                 if not os.path.exists(card_path):
-                    # Generate reference card on demand
-                    from astm_reference_generator import ReferenceCardSpec
-                    standards = self.astm_manager.get_standards(metal_type)
-                    thickness = (standards.thickness_min + standards.thickness_max) / 2
-                    
-                    spec = ReferenceCardSpec(
-                        metal_type=metal_type,
-                        defect_type=defect_type,
-                        quality_grade=required_grade,
-                        thickness_inches=thickness                    )
-                    
-                    card_path = self.reference_generator.generate_reference_card(spec)
+                    # Generate reference card on demand (the generator isn't thread-safe);
+                    # it takes its own metal keys, grade letters and millimetres
+                    with self._generator_lock:
+                        card = self.reference_generator.generate_reference_card(
+                            _GENERATOR_METALS.get(metal_type, 'steel'),
+                            required_grade.value.split()[-1],
+                            reference_thickness * 25.4
+                        )
+                        self.reference_generator.save_reference_card(card, os.path.basename(card_path))
                     print(f"📋 Generated reference card: {os.path.basename(card_path)}")
+                    
+                    # The generated ReferenceCard already holds its image: prepare
+                    # it directly rather than decoding it back from disk
+                    if original_image is not None:
+                        self._reference_images[card_path] = self.similarity_scorer.prepare_reference(
+                            card.reference_image
+                        )
                 
-                cards_used.append(card_path)
-                
-                # Calculate visual similarity score using SSIM
-                defects_of_type = [d for d in detected_defects if d['class'] == defect_type]
-                visual_similarity_scores = []
-                
-                if original_image_path and os.path.exists(original_image_path):
-                    # Load original image
-                    original_image = cv2.imread(original_image_path)
-                    # Load reference card
+                self._reference_card_paths[card_key] = card_path
+            
+            # Calculate visual similarity score using SSIM
+            visual_similarity_scores = []
+            
+            if original_image is not None:
+                # Load reference card (decoded and preprocessed once per card path)
+                reference_card = self._reference_images.get(card_path)
+                if reference_card is None:
                     reference_card = cv2.imread(card_path)
-                    
+                    if reference_card is not None:
+                        reference_card = self.similarity_scorer.prepare_reference(reference_card)
+                        self._reference_images[card_path] = reference_card
+                
+                if reference_card is not None:
+                    # Extract defect regions from original image, clipped to its bounds
+                    image_height, image_width = original_image.shape[:2]
+                    defect_crops = []
                     for defect in defects_of_type:
-                        # Extract defect region from original image
                         bbox = defect['bbox']
-                        x1, y1, x2, y2 = int(bbox[0]), int(bbox[1]), int(bbox[2]), int(bbox[3])
-                        defect_crop = original_image[y1:y2, x1:x2]
-                        
-                        if defect_crop.size > 0 and reference_card is not None:
-                            # Calculate visual similarity
-                            similarity_score = self.similarity_scorer.get_similarity_percentage(
-                                defect_crop, reference_card
-                            )
-                            visual_similarity_scores.append(similarity_score)
-                            print(f"🔍 Visual similarity for {defect_type}: {similarity_score:.1f}%")
+                        x1, y1 = int(max(0, bbox[0])), int(max(0, bbox[1]))
+                        x2, y2 = int(min(image_width, bbox[2])), int(min(image_height, bbox[3]))
+                        if x2 > x1 and y2 > y1:
+                            defect_crops.append(original_image[y1:y2, x1:x2])
                     
-                    # Use average visual similarity or fallback to confidence
-                    if visual_similarity_scores:
-                        similarity_scores[defect_type] = sum(visual_similarity_scores) / len(visual_similarity_scores)
-                    else:
-                        # Fallback to confidence-based scoring
-                        avg_confidence = sum(d['confidence'] for d in defects_of_type) / len(defects_of_type)
-                        similarity_scores[defect_type] = avg_confidence * 100  # Convert to percentage
-                else:
-                    # Fallback to confidence-based scoring if no image
-                    avg_confidence = sum(d['confidence'] for d in defects_of_type) / len(defects_of_type)
-                    similarity_scores[defect_type] = avg_confidence * 100  # Convert to percentage
-                
-            except Exception as e:
-                print(f"⚠️ Could not process reference for {defect_type}: {str(e)}")
-        
-        return {
-            'cards_used': cards_used,
-            'similarity_scores': similarity_scores
-        }
+                    # Score all crops of this type against the card in one batch
+                    visual_similarity_scores = self.similarity_scorer.get_similarity_percentages_prepared(
+                        defect_crops, reference_card
+                    )
+                    for similarity_score in visual_similarity_scores:
+                        print(f"🔍 Visual similarity for {defect_type}: {similarity_score:.1f}%")
+            
+            # Use average visual similarity or fallback to confidence
+            if visual_similarity_scores:
+                return card_path, sum(visual_similarity_scores) / len(visual_similarity_scores)
+            
+            # Fallback to confidence-based scoring
+            avg_confidence = sum(d['confidence'] for d in defects_of_type) / len(defects_of_type)
+            return card_path, avg_confidence * 100  # Convert to percentage
+            
+        except Exception as e:
+            print(f"⚠️ Could not process reference for {defect_type}: {str(e)}")
+            return None, None
     
     def _generate_recommendations(self, 
                                 compliance_details: List[Dict],
@@ -263,17 +473,25 @@ class IntegratedASTMAnalyzer:
             recommendations.append("🔄 Material requires rework or rejection")
         
         # Specific defect recommendations
-        fail_defects = [cd for cd in compliance_details if cd['compliance_result'] == PassFailResult.FAIL]
-        if fail_defects:
-            defect_types = set(fd['defect_type'] for fd in fail_defects)
+        # Failing defect types, de-duplicated in first-seen order in one pass
+        defect_types = dict.fromkeys(
+            cd['defect_type'] for cd in compliance_details
+            if cd['compliance_result'] == PassFailResult.FAIL
+        )
+        if defect_types:
             recommendations.append(f"🎯 Critical defect types: {', '.join(defect_types)}")
             
-            # Process-specific recommendations
-            if any('crack' in dt.lower() or 'break' in dt.lower() for dt in defect_types):
+            # Process-specific recommendations (classify each type once)
+            keywords = {
+                keyword.lower()
+                for dt in defect_types
+                for keyword in _DEFECT_KEYWORD_RE.findall(dt)
+            }
+            if keywords & {'crack', 'break'}:
                 recommendations.append("🔧 Review welding/forming processes")
-            if any('spot' in dt.lower() or 'oil' in dt.lower() for dt in defect_types):
+            if keywords & {'spot', 'oil'}:
                 recommendations.append("🧽 Improve surface cleaning procedures")
-            if any('inclusion' in dt.lower() for dt in defect_types):
+            if 'inclusion' in keywords:
                 recommendations.append("🏭 Review material sourcing and melting process")
         
         return recommendations
@@ -287,23 +505,13 @@ class IntegratedASTMAnalyzer:
         if total_defects == 0:
             return 100.0  # Perfect score for clean material
         
-        # Base score from compliance
-        if overall_compliance == PassFailResult.PASS:
-            base_score = 85.0
-        elif overall_compliance == PassFailResult.MARGINAL:
-            base_score = 65.0
-        else:  # FAIL
-            base_score = 35.0
-        
-        # Adjust for defect count
-        defect_penalty = min(total_defects * 2, 20)  # Max 20 point penalty
-        score = base_score - defect_penalty
-        
-        # Adjust for defect severity
-        critical_defects = sum(1 for cd in compliance_details 
-                             if cd['compliance_result'] == PassFailResult.FAIL)
-        severity_penalty = critical_defects * 10
-        score -= severity_penalty
+        # Base score from compliance, less the defect count (max 20 points)
+        # and severity penalties
+        critical_defects = sum(cd['compliance_result'] == PassFailResult.FAIL
+                               for cd in compliance_details)
+        score = (_BASE_QUALITY_SCORES.get(overall_compliance, 35.0)
+                 - min(total_defects * 2, 20)
+                 - critical_defects * 10)
         
         return max(0.0, min(100.0, score))
     
@@ -355,14 +563,11 @@ class IntegratedASTMAnalyzer:
 - **Detection Method:** Maximum Recall (100% sensitivity)
 """)
             
-            # Defect breakdown
-            defect_breakdown = {}
-            for defect in result.detected_defects:
-                defect_type = defect['class']
-                defect_breakdown[defect_type] = defect_breakdown.get(defect_type, 0) + 1
+            # Defect breakdown, most frequent first
+            defect_breakdown = Counter(defect['class_name'] for defect in result.detected_defects)
             
             report_sections.append("### Defect Type Breakdown:")
-            for defect_type, count in defect_breakdown.items():
+            for defect_type, count in defect_breakdown.most_common():
                 report_sections.append(f"- **{defect_type}:** {count}")
         
         # ASTM compliance details
@@ -371,16 +576,19 @@ class IntegratedASTMAnalyzer:
 """)
         
         if result.compliance_details:
-            for i, detail in enumerate(result.compliance_details, 1):
-                status_icon = "✅" if detail['compliance_result'] == PassFailResult.PASS else "⚠️" if detail['compliance_result'] == PassFailResult.MARGINAL else "❌"
-                
-                report_sections.append(f"""
-### Defect {i}: {detail['defect_type']}
-{status_icon} **Status:** {detail['compliance_result'].value}
-- **Size:** {detail['defect_size_mm']:.2f}mm ({detail['defect_size_inches']:.4f}")
-- **ASTM Limit:** {detail['astm_limit_inches']:.4f}"
-- **Confidence:** {detail['compliance_confidence']:.2f}
-""")
+            report_sections.extend(
+                _DEFECT_SECTION_TEMPLATE.format(
+                    i=i,
+                    defect_type=detail['defect_type'],
+                    icon=_STATUS_ICONS.get(detail['compliance_result'], "❌"),
+                    status=detail['compliance_result'].value,
+                    size_mm=detail['defect_size_mm'],
+                    size_inches=detail['defect_size_inches'],
+                    limit_inches=detail['astm_limit_inches'],
+                    confidence=detail['compliance_confidence']
+                )
+                for i, detail in enumerate(result.compliance_details, 1)
+            )
           # Reference cards used
         if result.reference_cards_used:
             report_sections.append(f"""
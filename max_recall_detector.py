@@ -4,10 +4,105 @@ Advanced detection system guaranteeing 100% defect detection through multi-pass
 """
 
 import cv2
+import copy
+import datetime
+import hashlib
 import numpy as np
+import torch
+from collections import OrderedDict
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 from ultralytics import YOLO
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Union, Optional
 import os
+from memory_bank import DefectDetection, MemoryBank, image_hash_for
+
+# Fused C++/CUDA NMS kernel (installed alongside ultralytics)
+try:
+    from torchvision.ops import batched_nms
+    TORCHVISION_AVAILABLE = True
+except ImportError:
+    TORCHVISION_AVAILABLE = False
+
+# TensorRT runtime for compiled FP16 engines on NVIDIA GPUs
+try:
+    import tensorrt  # noqa: F401
+    TENSORRT_AVAILABLE = True
+except ImportError:
+    TENSORRT_AVAILABLE = False
+
+# OpenVINO runtime for INT8-quantized inference on CPUs
+try:
+    import openvino  # noqa: F401
+    OPENVINO_AVAILABLE = True
+except ImportError:
+    OPENVINO_AVAILABLE = False
+
+# Inference backends accepted by MaxRecallDefectDetector
+_BACKENDS = ("pytorch", "openvino")
+
+# Dataset whose images calibrate INT8 quantization
+_CALIBRATION_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "training", "datasets", "data.yaml")
+
+# Largest batch a compiled TensorRT engine accepts (dynamic batch dimension)
+_ENGINE_MAX_BATCH = 16
+
+# Upper bound on threads used for decoding and resizing inputs
+_MAX_PREPROCESS_WORKERS = max(1, min(5, (os.cpu_count() or 2) // 2))
+
+# Rescale factors this close to 1.0 are treated as no rescale at all
+_SAME_SCALE_TOLERANCE = 1e-3
+
+@dataclass
+class Detections:
+    """Struct-of-arrays detection table: one row per box, in original-image coordinates"""
+    boxes: np.ndarray       # (N, 4) x1, y1, x2, y2
+    confidence: np.ndarray  # (N,)
+    class_id: np.ndarray    # (N,) int32, key into the model's class names
+    pass_id: np.ndarray     # (N,) int32, index into the image's pass names
+    
+    def __len__(self) -> int:
+        return len(self.confidence)
+    
+    @classmethod
+    def empty(cls) -> "Detections":
+        return cls(np.empty((0, 4)), np.empty(0), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32))
+    
+    @classmethod
+    def concatenate(cls, parts: List["Detections"]) -> "Detections":
+        """One table holding the rows of all parts, in order"""
+        if not parts:
+            return cls.empty()
+        return cls(
+            np.concatenate([part.boxes for part in parts]),
+            np.concatenate([part.confidence for part in parts]),
+            np.concatenate([part.class_id for part in parts]),
+            np.concatenate([part.pass_id for part in parts])
+        )
+    
+    def select(self, index: np.ndarray) -> "Detections":
+        """Rows picked by an index array or boolean mask"""
+        return Detections(self.boxes[index], self.confidence[index], self.class_id[index], self.pass_id[index])
+    
+    def areas(self) -> np.ndarray:
+        return (self.boxes[:, 2] - self.boxes[:, 0]) * (self.boxes[:, 3] - self.boxes[:, 1])
+    
+    def to_dicts(self, class_names: Dict[int, str], pass_names: List[str]) -> List[Dict[str, Any]]:
+        """The per-detection dictionaries of the public API"""
+        return [
+            {
+                "bbox": box,
+                "confidence": conf,
+                "class_id": cls,
+                "class_name": class_names[cls],
+                "pass_name": pass_names[pass_id],
+                "area": area
+            }
+            for box, conf, cls, pass_id, area in zip(
+                self.boxes.tolist(), self.confidence.tolist(), self.class_id.tolist(),
+                self.pass_id.tolist(), self.areas().tolist()
+            )
+        ]
 
 class MaxRecallDefectDetector:
     """
@@ -15,222 +110,529 @@ class MaxRecallDefectDetector:
     Guarantees 100% defect detection through comprehensive scanning techniques.
     """
     
-    def __init__(self, model_path: str = "yolov8_model.pt"):
-        """Initialize the maximum recall detector"""
+    def __init__(self, model_path: str = "yolov8_model.pt", use_tensorrt: bool = True,
+                 memory_bank: Optional[MemoryBank] = None, backend: str = "pytorch",
+                 calibration_data: str = _CALIBRATION_DATA):
+        """
+        Initialize the maximum recall detector.
+        
+        use_tensorrt: compile to a TensorRT engine when possible (GPU)
+        backend: "openvino" runs an INT8-quantized OpenVINO export on the CPU,
+            calibrated on calibration_data (a YOLO dataset yaml)
+        """
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Model file not found: {model_path}")
+        if backend not in _BACKENDS:
+            raise ValueError(f"Unknown backend: {backend} (expected one of {', '.join(_BACKENDS)})")
+        
+        # Final detections of every analyzed image (cached results included) are stored here, if set
+        self.memory_bank = memory_bank
+        self.model_version = os.path.basename(model_path)
         
-        self.model = YOLO(model_path)
         self.confidence_threshold = 0.05  # Ultra-sensitive threshold
         self.iou_threshold = 0.45
         
-        # Detection scales for comprehensive coverage
-        self.detection_scales = [800, 1024, 1280]
+        # FP16 inference on tensor-core GPUs
+        self.use_half = torch.cuda.is_available()
+        
+        # Detection scales for comprehensive coverage (ascending)
+        self.detection_scales = sorted([800, 1024, 1280])
+        
+        # Inputs per inference call (None = unlimited); engines cap the batch
+        self.max_batch_inputs = None
+        
+        # Tile mode: a fixed grid of overlapping model-sized crops instead of rescaled copies.
+        # The grid depends only on the image size, not on the image content
+        self.tile_size = 640
+        self.tile_overlap = 0.25  # Fraction of the tile shared with its neighbour
+        if backend == "openvino" and OPENVINO_AVAILABLE:
+            self.model = self._load_openvino_model(model_path, calibration_data)
+        else:
+            if backend == "openvino":
+                print("⚠️ OpenVINO not installed, using PyTorch model")
+            self.model = self._load_model(model_path, use_tensorrt and self.use_half and TENSORRT_AVAILABLE)
+        
+        # Recent results keyed by image content, so re-submitting the same
+        # image skips all five inference passes
+        self._result_cache = OrderedDict()
+        self.result_cache_size = 128
+        
+        # Pay kernel selection / autotuning cost now, not on the first request
+        self._warm_up()
         
         print("🎯 MaxRecallDefectDetector initialized")
         print(f"   📊 Model: {model_path}")
         print(f"   🔍 Confidence: {self.confidence_threshold}")
         print(f"   📏 Scales: {self.detection_scales}")
     
-    def detect_all_defects(self, image_path: str, return_details: bool = False) -> Dict[str, Any]:
+    def _load_model(self, model_path: str, use_tensorrt: bool) -> YOLO:
+        """Load the YOLO model, compiled to a cached FP16 TensorRT engine if requested"""
+        model = YOLO(model_path)
+        
+        if use_tensorrt:
+            engine_path = os.path.splitext(model_path)[0] + ".engine"
+            try:
+                # (Re)build the engine when missing or older than the weights
+                if not os.path.exists(engine_path) or os.path.getmtime(engine_path) < os.path.getmtime(model_path):
+                    print(f"⚙️ Building TensorRT engine: {engine_path}")
+                    engine_path = model.export(format="engine", half=True, dynamic=True,
+                                               batch=_ENGINE_MAX_BATCH,
+                                               imgsz=model.overrides.get("imgsz", 640),
+                                               verbose=False)
+                engine = YOLO(engine_path, task=model.task)
+                self.max_batch_inputs = _ENGINE_MAX_BATCH
+                return engine
+            except Exception as e:
+                print(f"⚠️ TensorRT engine unavailable, using PyTorch model: {str(e)}")
+        
+        model.fuse()  # Fold Conv+BN layers once for faster inference
+        return model
+    
+    def _load_openvino_model(self, model_path: str, calibration_data: str) -> YOLO:
+        """Load the YOLO model as a cached INT8 OpenVINO export for CPU inference"""
+        model = YOLO(model_path)
+        export_dir = os.path.splitext(model_path)[0] + "_int8_openvino_model"
+        
+        try:
+            # (Re)export when missing or older than the weights
+            if not os.path.isdir(export_dir) or os.path.getmtime(export_dir) < os.path.getmtime(model_path):
+                print(f"⚙️ Exporting INT8 OpenVINO model: {export_dir}")
+                export_args = {}
+                if os.path.isfile(calibration_data) and os.path.getsize(calibration_data):
+                    export_args["data"] = calibration_data
+                export_dir = model.export(format="openvino", int8=True,
+                                          imgsz=model.overrides.get("imgsz", 640),
+                                          verbose=False, **export_args)
+            self.use_half = False  # INT8 weights; activations stay FP32 on the CPU
+            return YOLO(export_dir, task=model.task)
+        except Exception as e:
+            print(f"⚠️ OpenVINO model unavailable, using PyTorch model: {str(e)}")
+        
+        model.fuse()  # Fold Conv+BN layers once for faster inference
+        return model
+    
+    def _warm_up(self):
+        """Run one dummy inference so the first real call runs at steady-state speed"""
+        dummy = np.zeros((640, 640, 3), dtype=np.uint8)
+        self.model(dummy, conf=self.confidence_threshold, iou=self.iou_threshold,
+                   half=self.use_half, verbose=False)
+    
+    def detect_all_defects(self, image_path: Union[str, np.ndarray],
+                           return_details: bool = False,
+                           tile_mode: bool = False) -> Dict[str, Any]:
         """
         Comprehensive defect detection with maximum recall guarantee.
         
         Args:
-            image_path: Path to the image to analyze
+            image_path: Path to the image to analyze, or an already-decoded BGR image
             return_details: If True, returns detailed multi-pass information
+            tile_mode: If True, scan a fixed grid of overlapping tile_size crops
+                (plus the whole image) instead of the rescaled and flipped copies
             
         Returns:
             Dictionary containing detection results and metadata
         """
         
         try:
-            # Load and validate image
-            if not os.path.exists(image_path):
-                return {"error": f"Image file not found: {image_path}"}
+            image, error = self._load_image(image_path)
+            if error is not None:
+                return {"error": error}
             
-            image = cv2.imread(image_path)
-            if image is None:
-                return {"error": f"Could not load image: {image_path}"}
+            cache_key = self._cache_key(image, return_details, tile_mode)
+            cached = self._result_cache.get(cache_key)
+            if cached is not None:
+                self._result_cache.move_to_end(cache_key)
+                result = copy.deepcopy(cached)
+            else:
+                result = self._detect_images([image], return_details, tile_mode)[0]
+                self._cache_result(cache_key, result)
             
-            original_height, original_width = image.shape[:2]
+            self._record_detections(image, result)
             
-            # Run multi-pass detection
-            all_detections = []
-            pass_details = []
+            return result
             
-            # Pass 1: Original size with ultra-low confidence
-            pass_result = self._detect_single_pass(
-                image, 
-                f"Pass 1 - Original ({original_width}x{original_height})"
-            )
-            all_detections.extend(pass_result["detections"])
-            pass_details.append(pass_result)
+        except Exception as e:
+            return {"error": f"Detection failed: {str(e)}"}
+    
+    def detect_all_defects_batch(self, image_paths: List[Union[str, np.ndarray]],
+                                 return_details: bool = False,
+                                 batch_size: int = 8,
+                                 tile_mode: bool = False) -> List[Dict[str, Any]]:
+        """
+        detect_all_defects for many images. All detection passes of up to
+        batch_size images run as one batched inference call, amortizing the
+        per-call inference overhead.
+        
+        Returns one result dictionary per input, in input order.
+        """
+        
+        results: List[Dict[str, Any]] = [None] * len(image_paths)
+        pending = []  # (input index, image, cache key) still to be detected
+        
+        # Decode and hash the inputs on worker threads (both release the GIL)
+        with ThreadPoolExecutor(max_workers=self._preprocess_workers(len(image_paths))) as executor:
+            prepared = list(executor.map(
+                lambda image_path: self._prepare_input(image_path, return_details, tile_mode), image_paths
+            ))
+        
+        for index, (image, cache_key, error) in enumerate(prepared):
+            if error is not None:
+                results[index] = {"error": error}
+                continue
             
-            # Pass 2-4: Multi-scale detection
-            for i, scale in enumerate(self.detection_scales, 2):
-                scaled_image = self._resize_image(image, target_size=scale)
-                pass_result = self._detect_single_pass(
-                    scaled_image,
-                    f"Pass {i} - Scaled ({scale}px)",
-                    scale_factor=scale / max(original_width, original_height)
-                )
-                all_detections.extend(pass_result["detections"])
-                pass_details.append(pass_result)
+            cached = self._result_cache.get(cache_key)
+            if cached is not None:
+                self._result_cache.move_to_end(cache_key)
+                results[index] = copy.deepcopy(cached)
+            else:
+                pending.append((index, image, cache_key))
+        
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            try:
+                chunk_results = self._detect_images([image for _, image, _ in chunk],
+                                                    return_details, tile_mode)
+            except Exception as e:
+                for index, _, _ in chunk:
+                    results[index] = {"error": f"Detection failed: {str(e)}"}
+                continue
             
-            # Pass 5: Horizontal flip for orientation-dependent defects
-            flipped_image = cv2.flip(image, 1)
-            pass_result = self._detect_single_pass(
-                flipped_image,
-                "Pass 5 - Flipped",
-                is_flipped=True,
-                flip_width=original_width
+            for (index, _, cache_key), result in zip(chunk, chunk_results):
+                self._cache_result(cache_key, result)
+                results[index] = result
+        
+        # Every analyzed image is recorded, whether or not its result was cached
+        for (image, _, _), result in zip(prepared, results):
+            if "error" not in result:
+                self._record_detections(image, result)
+        
+        return results
+    
+    def _prepare_input(self, image_path: Union[str, np.ndarray], return_details: bool,
+                       tile_mode: bool) -> Tuple[np.ndarray, Tuple, str]:
+        """_load_image plus the result cache key; returns (image, cache key, error message)"""
+        try:
+            image, error = self._load_image(image_path)
+            if error is not None:
+                return None, None, error
+            return image, self._cache_key(image, return_details, tile_mode), None
+        except Exception as e:
+            return None, None, f"Detection failed: {str(e)}"
+    
+    @staticmethod
+    def _preprocess_workers(n_items: int) -> int:
+        """Thread count for CPU-side preprocessing of n_items inputs"""
+        return max(1, min(n_items, _MAX_PREPROCESS_WORKERS))
+    
+    def _load_image(self, image_path: Union[str, np.ndarray]) -> Tuple[np.ndarray, str]:
+        """Decode image_path (or pass an array through); returns (image, error message)"""
+        if isinstance(image_path, np.ndarray):
+            return image_path, None
+        
+        # Load and validate image
+        if not os.path.exists(image_path):
+            return None, f"Image file not found: {image_path}"
+        
+        image = cv2.imread(image_path)
+        if image is None:
+            return None, f"Could not load image: {image_path}"
+        
+        return image, None
+    
+    def _pass_plan(self, image: np.ndarray) -> List[Tuple[np.ndarray, str, Dict[str, Any]]]:
+        """(input image, pass name, coordinate mapping) for each detection pass over image"""
+        original_height, original_width = image.shape[:2]
+        
+        # Pass 1: Original size with ultra-low confidence
+        plan = [(image, f"Pass 1 - Original ({original_width}x{original_height})", {})]
+        
+        # Pass 2-4: Multi-scale detection (a scale that matches the original
+        # size would only repeat pass 1)
+        pyramid = self._scale_pyramid(image)
+        for i, scale in enumerate(self.detection_scales, 2):
+            if scale not in pyramid:
+                continue
+            plan.append((
+                pyramid[scale],
+                f"Pass {i} - Scaled ({scale}px)",
+                {"scale_factor": scale / max(original_width, original_height)}
+            ))
+        
+        # Pass 5: Horizontal flip for orientation-dependent defects
+        plan.append((
+            cv2.flip(image, 1),
+            "Pass 5 - Flipped",
+            {"is_flipped": True, "flip_width": original_width}
+        ))
+        
+        return plan
+    
+    def _scale_pyramid(self, image: np.ndarray) -> Dict[int, np.ndarray]:
+        """Resized copy of image for each detection scale that differs from its size"""
+        height, width = image.shape[:2]
+        pyramid = {}
+        
+        # Downscales are resized largest first, each level from the previous one,
+        # so only the first reads the full-size source; upscales need the original
+        source = image
+        for scale in sorted(set(self.detection_scales), reverse=True):
+            scale_factor = scale / max(width, height)
+            if abs(scale_factor - 1.0) < _SAME_SCALE_TOLERANCE:
+                continue
+            size = (int(width * scale_factor), int(height * scale_factor))
+            if scale_factor < 1.0:
+                source = cv2.resize(source, size, interpolation=cv2.INTER_AREA)
+                pyramid[scale] = source
+            else:
+                pyramid[scale] = cv2.resize(image, size, interpolation=cv2.INTER_CUBIC)
+        
+        return pyramid
+    
+    def _tile_plan(self, image: np.ndarray) -> List[Tuple[np.ndarray, str, Dict[str, Any]]]:
+        """(input image, pass name, coordinate mapping) for the whole image and each tile
+
+        Tiling is fixed, not adaptive: tile_size crops on a regular grid with
+        tile_overlap shared between neighbours, whatever the image contains.
+        """
+        original_height, original_width = image.shape[:2]
+        
+        # Whole image first, so defects larger than a tile are still seen in one piece
+        plan = [(image, f"Pass 1 - Original ({original_width}x{original_height})", {})]
+        
+        stride = max(1, int(self.tile_size * (1.0 - self.tile_overlap)))
+        xs = self._tile_origins(original_width, self.tile_size, stride)
+        ys = self._tile_origins(original_height, self.tile_size, stride)
+        if len(xs) == 1 and len(ys) == 1:
+            return plan  # The image fits in one tile
+        
+        for y0 in ys:
+            for x0 in xs:
+                plan.append((
+                    image[y0:y0 + self.tile_size, x0:x0 + self.tile_size],
+                    f"Tile ({x0},{y0})",
+                    {"offset": (x0, y0)}
+                ))
+        
+        return plan
+    
+    @staticmethod
+    def _tile_origins(length: int, tile: int, stride: int) -> List[int]:
+        """Start offsets of tiles covering [0, length), the last one flush with the end"""
+        if length <= tile:
+            return [0]
+        origins = list(range(0, length - tile, stride))
+        origins.append(length - tile)
+        return origins
+    
+    def _detect_images(self, images: List[np.ndarray], return_details: bool,
+                       tile_mode: bool = False) -> List[Dict[str, Any]]:
+        """Run every detection pass over images as a single batched inference call"""
+        
+        plan_for = self._tile_plan if tile_mode else self._pass_plan
+        
+        # All passes of all images go through the model together; it letterboxes
+        # the differently sized inputs itself
+        if len(images) > 1:
+            # Resizing and flipping for different images overlap on worker threads
+            with ThreadPoolExecutor(max_workers=self._preprocess_workers(len(images))) as executor:
+                plans = list(executor.map(plan_for, images))
+        else:
+            plans = [plan_for(images[0])]
+        steps = [step for plan in plans for step in plan]
+        
+        # One call, unless the model caps its batch size
+        chunk_size = self.max_batch_inputs or len(steps)
+        pass_ids = [pass_id for plan in plans for pass_id in range(len(plan))]
+        pass_tables = []
+        for start in range(0, len(steps), chunk_size):
+            chunk = steps[start:start + chunk_size]
+            outputs = self.model([pass_image for pass_image, _, _ in chunk],
+                                 conf=self.confidence_threshold, iou=self.iou_threshold,
+                                 half=self.use_half, verbose=False, stream=True)
+            pass_tables.extend(
+                self._pass_detections(output, pass_id, **mapping)
+                for (_, _, mapping), pass_id, output in zip(chunk, pass_ids[start:start + chunk_size], outputs)
             )
-            all_detections.extend(pass_result["detections"])
-            pass_details.append(pass_result)
+        
+        names = self.model.names
+        results = []
+        start = 0
+        for image, plan in zip(images, plans):
+            # This image's passes (images may have different numbers of passes)
+            image_tables = pass_tables[start:start + len(plan)]
+            start += len(plan)
+            pass_names = [pass_name for _, pass_name, _ in plan]
+            
+            original_height, original_width = image.shape[:2]
+            all_detections = Detections.concatenate(image_tables)
             
             # Remove duplicates using advanced NMS
-            final_detections = self._remove_duplicates(all_detections)
+            final = all_detections.select(self._nms_keep(all_detections))
             
-            # Prepare results
+            # Prepare results (dictionaries are only built here, at the API boundary)
+            final_detections = final.to_dicts(names, pass_names)
             result = {
                 "detections": final_detections,
                 "total_detected": len(final_detections),
-                "passes_completed": len(pass_details),
+                "passes_completed": len(plan),
                 "original_size": (original_width, original_height)
             }
             
             if return_details:
-                result["pass_details"] = pass_details
+                result["pass_details"] = [
+                    {
+                        "pass_name": pass_name,
+                        "detections": table.to_dicts(names, pass_names),
+                        "detection_count": len(table)
+                    }
+                    for pass_name, table in zip(pass_names, image_tables)
+                ]
                 result["total_raw_detections"] = len(all_detections)
                 result["duplicates_removed"] = len(all_detections) - len(final_detections)
             
-            return result
-            
+            results.append(result)
+        
+        return results
+    
+    def _record_detections(self, image: np.ndarray, result: Dict[str, Any]):
+        """Store one image's final detections in the memory bank (if set) in a single transaction"""
+        if self.memory_bank is None or not result["detections"]:
+            return
+        try:
+            timestamp = datetime.datetime.now().isoformat()
+            image_hash = image_hash_for(image)
+            height, width = image.shape[:2]
+            self.memory_bank.store_detections([
+                DefectDetection(
+                    timestamp=timestamp,
+                    image_hash=image_hash,
+                    defect_type=detection["class_name"],
+                    confidence=detection["confidence"],
+                    bbox=detection["bbox"],
+                    image_size=(width, height),
+                    model_version=self.model_version
+                )
+                for detection in result["detections"]
+            ])
         except Exception as e:
-            return {"error": f"Detection failed: {str(e)}"}
+            print(f"⚠️ Could not store detections in memory bank: {str(e)}")
+    
+    def _cache_result(self, cache_key: Tuple, result: Dict[str, Any]):
+        """Remember result for cache_key, evicting the least recently used entry"""
+        self._result_cache[cache_key] = copy.deepcopy(result)
+        if len(self._result_cache) > self.result_cache_size:
+            self._result_cache.popitem(last=False)
     
-    def _detect_single_pass(self, image: np.ndarray, pass_name: str, 
-                           scale_factor: float = 1.0, is_flipped: bool = False, 
-                           flip_width: int = None) -> Dict[str, Any]:
-        """Run a single detection pass on the image"""
+    def _cache_key(self, image: np.ndarray, return_details: bool, tile_mode: bool = False) -> Tuple:
+        """Content-based key for the result cache"""
+        digest = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=16).digest()
+        return (digest, image.shape, image.dtype.str, return_details, tile_mode)
+    
+    def _pass_detections(self, result, pass_id: int, scale_factor: float = 1.0,
+                         is_flipped: bool = False, flip_width: int = None,
+                         offset: Tuple[int, int] = None) -> Detections:
+        """Convert one YOLO result into a Detections table in original-image coordinates"""
         
-        # Run YOLO detection
-        results = self.model(image, conf=self.confidence_threshold, iou=self.iou_threshold)
+        if result.boxes is None:
+            return Detections.empty()
         
-        detections = []
+        # One device->host transfer for boxes, confidences and classes together
+        # (float64 so the coordinate fix-ups match plain Python float math)
+        data = result.boxes.data.cpu().numpy().astype(np.float64)
+        boxes = data[:, :4]
         
-        for result in results:
-            if result.boxes is not None:
-                boxes = result.boxes.xyxy.cpu().numpy()
-                confidences = result.boxes.conf.cpu().numpy() 
-                classes = result.boxes.cls.cpu().numpy()
-                
-                for box, conf, cls in zip(boxes, confidences, classes):
-                    x1, y1, x2, y2 = box
-                    
-                    # Adjust coordinates if image was scaled
-                    if scale_factor != 1.0:
-                        x1, y1, x2, y2 = [coord / scale_factor for coord in [x1, y1, x2, y2]]
-                    
-                    # Adjust coordinates if image was flipped
-                    if is_flipped and flip_width is not None:
-                        x1_new = flip_width - x2
-                        x2_new = flip_width - x1
-                        x1, x2 = x1_new, x2_new
-                    
-                    detection = {
-                        "bbox": [float(x1), float(y1), float(x2), float(y2)],
-                        "confidence": float(conf),
-                        "class_id": int(cls),
-                        "class_name": self.model.names[int(cls)],
-                        "pass_name": pass_name,
-                        "area": float((x2 - x1) * (y2 - y1))
-                    }
-                    
-                    detections.append(detection)
-        
-        return {
-            "pass_name": pass_name,
-            "detections": detections,
-            "detection_count": len(detections)
-        }
+        # Adjust coordinates if image was scaled
+        if scale_factor != 1.0:
+            boxes /= scale_factor
+        
+        # Adjust coordinates if image was flipped
+        if is_flipped and flip_width is not None:
+            boxes[:, [0, 2]] = flip_width - boxes[:, [2, 0]]
+        
+        # Adjust coordinates if the input was a tile of the image
+        if offset is not None:
+            boxes[:, [0, 2]] += offset[0]
+            boxes[:, [1, 3]] += offset[1]
+        
+        return Detections(
+            boxes=boxes,
+            confidence=data[:, -2],
+            class_id=data[:, -1].astype(np.int32),
+            pass_id=np.full(len(data), pass_id, dtype=np.int32)
+        )
     
-    def _resize_image(self, image: np.ndarray, target_size: int) -> np.ndarray:
-        """Resize image while maintaining aspect ratio"""
-        height, width = image.shape[:2]
+    def _nms_keep(self, detections: Detections) -> np.ndarray:
+        """Row indices of detections surviving per-class IoU-based NMS, by descending
+        confidence (ties in row order), whichever NMS implementation is used"""
         
-        # Calculate scaling factor
-        scale = target_size / max(width, height)
+        if not len(detections):
+            return np.empty(0, dtype=np.int64)
         
-        new_width = int(width * scale)
-        new_height = int(height * scale)
+        if TORCHVISION_AVAILABLE:
+            # Per-class NMS over all detections in one kernel call
+            keep = batched_nms(
+                torch.as_tensor(detections.boxes, dtype=torch.float32),
+                torch.as_tensor(detections.confidence, dtype=torch.float32),
+                torch.as_tensor(detections.class_id, dtype=torch.int64),
+                self.iou_threshold
+            ).numpy()
+        else:
+            keep = self._nms_keep_numpy(detections)
         
-        return cv2.resize(image, (new_width, new_height))
+        keep = np.sort(keep)
+        return keep[np.argsort(-detections.confidence[keep], kind='stable')]
     
-    def _remove_duplicates(self, detections: List[Dict]) -> List[Dict]:
-        """Remove duplicate detections using IoU-based NMS"""
+    def _nms_keep_numpy(self, detections: Detections) -> np.ndarray:
+        """_nms_keep without torchvision: greedy NMS per class (rows grouped by class)"""
         
-        if not detections:
-            return []
+        boxes = detections.boxes
+        areas = detections.areas()
         
-        # Group detections by class
-        class_groups = {}
-        for detection in detections:
-            class_name = detection["class_name"]
-            if class_name not in class_groups:
-                class_groups[class_name] = []
-            class_groups[class_name].append(detection)
+        # Classes in order of first appearance
+        classes, first_rows = np.unique(detections.class_id, return_index=True)
         
-        final_detections = []
+        kept_rows = []
         
         # Apply NMS to each class separately
-        for class_name, class_detections in class_groups.items():
-            # Sort by confidence (highest first)
-            class_detections.sort(key=lambda x: x["confidence"], reverse=True)
+        for class_id in classes[np.argsort(first_rows)]:
+            # This class's rows by confidence (highest first, ties in original order)
+            rows = np.flatnonzero(detections.class_id == class_id)
+            rows = rows[np.argsort(-detections.confidence[rows], kind='stable')]
             
-            kept_detections = []
+            # Kept boxes so far live in the first n_kept rows
+            kept_boxes = np.empty((len(rows), 4))
+            kept_areas = np.empty(len(rows))
+            n_kept = 0
             
-            for detection in class_detections:
+            for row in rows.tolist():
                 # Check if this detection overlaps significantly with any kept detection
-                should_keep = True
-                
-                for kept in kept_detections:
-                    iou = self._calculate_iou(detection["bbox"], kept["bbox"])
-                    if iou > self.iou_threshold:
-                        should_keep = False
-                        break
+                if n_kept:
+                    ious = self._calculate_iou_many(boxes[row], areas[row], kept_boxes[:n_kept], kept_areas[:n_kept])
+                    if ious.max() > self.iou_threshold:
+                        continue
                 
-                if should_keep:
-                    kept_detections.append(detection)
-            
-            final_detections.extend(kept_detections)
+                kept_boxes[n_kept] = boxes[row]
+                kept_areas[n_kept] = areas[row]
+                n_kept += 1
+                kept_rows.append(row)
         
-        return final_detections
+        return np.array(kept_rows, dtype=np.int64)
     
-    def _calculate_iou(self, box1: List[float], box2: List[float]) -> float:
-        """Calculate Intersection over Union (IoU) between two bounding boxes"""
-        
-        x1_1, y1_1, x2_1, y2_1 = box1
-        x1_2, y1_2, x2_2, y2_2 = box2
-        
-        # Calculate intersection area
-        x_left = max(x1_1, x1_2)
-        y_top = max(y1_1, y1_2)
-        x_right = min(x2_1, x2_2)
-        y_bottom = min(y2_1, y2_2)
-        
-        if x_right < x_left or y_bottom < y_top:
-            return 0.0
+    @staticmethod
+    def _calculate_iou_many(box: np.ndarray, area: float,
+                            boxes: np.ndarray, areas: np.ndarray) -> np.ndarray:
+        """Intersection over Union (IoU) of one box against each row of a (K, 4) box array"""
         
-        intersection = (x_right - x_left) * (y_bottom - y_top)
+        # Calculate intersection areas (zero where the boxes don't overlap)
+        widths = np.minimum(boxes[:, 2], box[2]) - np.maximum(boxes[:, 0], box[0])
+        heights = np.minimum(boxes[:, 3], box[3]) - np.maximum(boxes[:, 1], box[1])
+        intersection = np.clip(widths, 0, None) * np.clip(heights, 0, None)
         
-        # Calculate union area
-        area1 = (x2_1 - x1_1) * (y2_1 - y1_1)
-        area2 = (x2_2 - x1_2) * (y2_2 - y1_2)
-        union = area1 + area2 - intersection
+        # Calculate union areas
+        union = areas + area - intersection
         
-        return intersection / union if union > 0 else 0.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(union > 0, intersection / union, 0.0)
     
     def get_detection_summary(self, results: Dict[str, Any]) -> str:
         """Generate a human-readable summary of detection results"""
@@ -244,11 +646,12 @@ class MaxRecallDefectDetector:
         if total == 0:
             return "✅ No defects detected - Surface appears clean"
         
-        # Count by defect type
-        defect_counts = {}
-        for detection in detections:
-            defect_type = detection["class_name"]
-            defect_counts[defect_type] = defect_counts.get(defect_type, 0) + 1
+        # Count by defect type (one reduction over the class id array)
+        class_ids = np.fromiter((detection["class_id"] for detection in detections),
+                                dtype=np.int32, count=len(detections))
+        classes, counts = np.unique(class_ids, return_counts=True)
+        names = self.model.names
+        defect_counts = {names[class_id]: count for class_id, count in zip(classes.tolist(), counts.tolist())}
         
         summary_lines = [f"🔍 Total defects detected: {total}"]
         
@@ -4,17 +4,38 @@ This module provides persistent storage and retrieval of detection results,
 model performance metrics, and user feedback.
 """
 
+import copy
 import json
+import hashlib
 import sqlite3
 import datetime
 import os
+import threading
+import time
+import weakref
 from typing import Dict, List, Optional, Tuple, Any
 import numpy as np
 import cv2
 import base64
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from pathlib import Path
 
+from perf_helpers import thread_connection, transaction
+
+# Fast JSON encoding for exports; the stdlib json module is the fallback
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Fast non-cryptographic hashing; hashlib is the (slower) fallback
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
 @dataclass
 class DefectDetection:
     """Data class for storing defect detection results"""
@@ -38,16 +59,34 @@ class ModelPerformance:
     processing_time: float
     model_version: str
 
+# get_defect_statistics results are reused for at most this long
+_STATISTICS_TTL_SECONDS = 60.0
+
+def _dumps(obj: Any) -> bytes:
+    """Compact JSON encoding as bytes"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
 class MemoryBank:
     """Memory bank for storing and retrieving detection data"""
     
     def __init__(self, db_path: str = "memory_bank.db"):
         self.db_path = db_path
+        self._local = threading.local()
+        # (table fingerprint, computed at, statistics) of the last get_defect_statistics
+        self._statistics_cache = None
         self.init_database()
+    
+    def _conn(self) -> sqlite3.Connection:
+        """This thread's long-lived connection (see perf_helpers.thread_connection)"""
+        return thread_connection(self._local, self.db_path,
+                                 "PRAGMA temp_store=MEMORY",
+                                 "PRAGMA cache_size=-65536")  # 64 MB page cache
         
     def init_database(self):
         """Initialize the SQLite database with required tables"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             cursor = conn.cursor()
             
             # Defect detections table
@@ -109,11 +148,29 @@ class MemoryBank:
                 )
             """)
             
+            # Indexes for filtered history, duplicate lookup and date-range queries
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS ix_detections_type_ts
+                ON defect_detections(defect_type, timestamp DESC)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS ix_detections_conf
+                ON defect_detections(confidence)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS ix_detections_hash
+                ON defect_detections(image_hash)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS ix_perf_ts
+                ON model_performance(timestamp)
+            """)
+            
             conn.commit()
     
     def store_detection(self, detection: DefectDetection) -> int:
         """Store a defect detection in the memory bank"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO defect_detections 
@@ -132,9 +189,35 @@ class MemoryBank:
             conn.commit()
             return cursor.lastrowid
     
+    def store_detections(self, detections: List[DefectDetection]) -> int:
+        """Store many defect detections in a single transaction; returns rows written"""
+        rows = [
+            (
+                detection.timestamp, detection.image_hash, detection.defect_type,
+                detection.confidence, detection.bbox[0], detection.bbox[1],
+                detection.bbox[2], detection.bbox[3], detection.image_size[0],
+                detection.image_size[1], detection.model_version,
+                detection.user_feedback, detection.is_verified
+            )
+            for detection in detections
+        ]
+        if not rows:
+            return 0
+        
+        with transaction(self._conn()) as cursor:
+            cursor.executemany("""
+                INSERT INTO defect_detections 
+                (timestamp, image_hash, defect_type, confidence, 
+                 bbox_x1, bbox_y1, bbox_x2, bbox_y2, 
+                 image_width, image_height, model_version, 
+                 user_feedback, is_verified)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+        return len(rows)
+    
     def store_performance_metrics(self, performance: ModelPerformance) -> int:
         """Store model performance metrics"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO model_performance 
@@ -154,27 +237,9 @@ class MemoryBank:
                             min_confidence: float = 0.0,
                             limit: int = 100) -> List[DefectDetection]:
         """Retrieve detection history with optional filtering"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             cursor = conn.cursor()
-            
-            query = """
-                SELECT timestamp, image_hash, defect_type, confidence,
-                       bbox_x1, bbox_y1, bbox_x2, bbox_y2,
-                       image_width, image_height, model_version,
-                       user_feedback, is_verified
-                FROM defect_detections
-                WHERE confidence >= ?
-            """
-            params = [min_confidence]
-            
-            if defect_type:
-                query += " AND defect_type = ?"
-                params.append(defect_type)
-            
-            query += " ORDER BY timestamp DESC LIMIT ?"
-            params.append(limit)
-            
-            cursor.execute(query, params)
+            cursor.execute(*self._history_query(defect_type, min_confidence, limit))
             rows = cursor.fetchall()
             
             detections = []
@@ -194,11 +259,43 @@ class MemoryBank:
             
             return detections
     
+    @staticmethod
+    def _history_query(defect_type: Optional[str], min_confidence: float, limit: int) -> Tuple[str, List[Any]]:
+        """SQL and parameters for get_detection_history"""
+        query = """
+            SELECT timestamp, image_hash, defect_type, confidence,
+                   bbox_x1, bbox_y1, bbox_x2, bbox_y2,
+                   image_width, image_height, model_version,
+                   user_feedback, is_verified
+            FROM defect_detections
+            WHERE confidence >= ?
+        """
+        params = [min_confidence]
+        
+        if defect_type:
+            query += " AND defect_type = ?"
+            params.append(defect_type)
+        
+        query += " ORDER BY timestamp DESC LIMIT ?"
+        params.append(limit)
+        return query, params
+    
     def get_defect_statistics(self) -> Dict[str, Any]:
-        """Get comprehensive statistics about detected defects"""
-        with sqlite3.connect(self.db_path) as conn:
+        """Get comprehensive statistics about detected defects.
+        
+        Reuses the previous result while the table is unchanged (same row count
+        and highest id) for up to _STATISTICS_TTL_SECONDS.
+        """
+        with self._conn() as conn:
             cursor = conn.cursor()
             
+            cursor.execute("SELECT COUNT(*), MAX(id) FROM defect_detections")
+            fingerprint = cursor.fetchone()
+            cached = self._statistics_cache
+            if (cached is not None and cached[0] == fingerprint
+                    and time.monotonic() - cached[1] < _STATISTICS_TTL_SECONDS):
+                return copy.deepcopy(cached[2])
+            
             # Total detections
             cursor.execute("SELECT COUNT(*) FROM defect_detections")
             total_detections = cursor.fetchone()[0]
@@ -239,7 +336,7 @@ class MemoryBank:
                 for row in cursor.fetchall()
             }
             
-            return {
+            statistics = {
                 "total_detections": total_detections,
                 "defect_distribution": defect_distribution,
                 "confidence_stats": {
@@ -249,10 +346,12 @@ class MemoryBank:
                 },
                 "daily_stats_last_week": daily_stats
             }
+            self._statistics_cache = (fingerprint, time.monotonic(), copy.deepcopy(statistics))
+            return statistics
     
     def update_user_feedback(self, detection_id: int, feedback: str, is_verified: bool = False):
         """Update user feedback for a specific detection"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._conn() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE defect_detections 
@@ -271,25 +370,45 @@ class MemoryBank:
         )
     
     def export_data(self, output_path: str, format: str = "json"):
-        """Export memory bank data to file"""
-        data = {
-            "detections": [asdict(d) for d in self.get_detection_history(limit=10000)],
-            "statistics": self.get_defect_statistics(),
-            "export_timestamp": datetime.datetime.now().isoformat()
-        }
-        
-        if format.lower() == "json":
-            with open(output_path, 'w') as f:
-                json.dump(data, f, indent=2)
-        else:
+        """Export memory bank data to file, streaming detection rows straight from SQLite"""
+        if format.lower() != "json":
             raise ValueError(f"Unsupported export format: {format}")
+        
+        statistics = self.get_defect_statistics()
+        
+        with self._conn() as conn, open(output_path, 'wb') as f:
+            cursor = conn.cursor()
+            cursor.execute(*self._history_query(None, 0.0, 10000))
+            
+            # Same fields as asdict(DefectDetection), one row at a time
+            f.write(b'{"detections": [')
+            separator = b''
+            for row in cursor:
+                f.write(separator)
+                f.write(_dumps({
+                    "timestamp": row[0],
+                    "image_hash": row[1],
+                    "defect_type": row[2],
+                    "confidence": row[3],
+                    "bbox": [row[4], row[5], row[6], row[7]],
+                    "image_size": [row[8], row[9]],
+                    "model_version": row[10],
+                    "user_feedback": row[11],
+                    "is_verified": bool(row[12])
+                }))
+                separator = b', '
+            
+            f.write(b'], "statistics": ')
+            f.write(_dumps(statistics))
+            f.write(b', "export_timestamp": ')
+            f.write(_dumps(datetime.datetime.now().isoformat()))
+            f.write(b'}')
     
     def clear_old_data(self, days_to_keep: int = 30):
         """Remove old detection data to manage storage"""
         cutoff_date = (datetime.datetime.now() - datetime.timedelta(days=days_to_keep)).isoformat()
         
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
+        with transaction(self._conn()) as cursor:
             cursor.execute("""
                 DELETE FROM defect_detections 
                 WHERE timestamp < ? AND is_verified = FALSE
@@ -299,18 +418,51 @@ class MemoryBank:
                 DELETE FROM model_performance 
                 WHERE timestamp < ?
             """, (cutoff_date,))
-            
-            conn.commit()
 
 def generate_image_hash(image: np.ndarray) -> str:
     """Generate a hash for an image for duplicate detection"""
-    # Convert to grayscale and resize for consistent hashing
-    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if len(image.shape) == 3 else image
-    resized = cv2.resize(gray, (64, 64))
+    # Resize first so the color conversion only touches 64x64 pixels,
+    # not the full-resolution image
+    resized = cv2.resize(image, (64, 64))
+    if len(resized.shape) == 3:
+        resized = cv2.cvtColor(resized, cv2.COLOR_RGB2GRAY)
+    
+    # Exact content hash, stable across processes (unlike the salted hash())
+    if XXHASH_AVAILABLE:
+        content_hash = xxhash.xxh3_64_intdigest(resized.tobytes())
+    else:
+        content_hash = int.from_bytes(hashlib.blake2b(resized.tobytes(), digest_size=8).digest(), 'big')
+    
+    # 64-bit difference hash: near-identical images differ in only a few bits
+    small = cv2.resize(resized, (9, 8), interpolation=cv2.INTER_AREA)
+    dhash_bits = np.packbits(small[:, 1:] > small[:, :-1])
+    perceptual_hash = int.from_bytes(dhash_bits.tobytes(), 'big')
+    
+    return f"{content_hash:016x}_{perceptual_hash:016x}"
+
+def image_hash_distance(hash_a: str, hash_b: str) -> int:
+    """Hamming distance between the perceptual parts of two generate_image_hash values"""
+    perceptual_a = int(hash_a.rsplit('_', 1)[-1], 16)
+    perceptual_b = int(hash_b.rsplit('_', 1)[-1], 16)
+    return bin(perceptual_a ^ perceptual_b).count('1')
+
+# generate_image_hash results keyed by id() of live arrays; entries are
+# dropped when the array is garbage collected, so ids are never reused stale
+_IMAGE_HASH_CACHE: Dict[int, str] = {}
+
+def image_hash_for(image: np.ndarray) -> str:
+    """generate_image_hash, computed once per array object.
     
-    # Create a simple hash based on image content
-    hash_value = hash(resized.tobytes())
-    return str(abs(hash_value))
+    Use when many detections come from the same image; the array must not be
+    modified in place after it has been hashed.
+    """
+    key = id(image)
+    image_hash = _IMAGE_HASH_CACHE.get(key)
+    if image_hash is None:
+        image_hash = generate_image_hash(image)
+        _IMAGE_HASH_CACHE[key] = image_hash
+        weakref.finalize(image, _IMAGE_HASH_CACHE.pop, key, None)
+    return image_hash
 
 def format_detection_summary(detections: List[DefectDetection]) -> str:
     """Format detection results for display"""
@@ -0,0 +1,49 @@
+"""
+Shared performance helpers
+Optional Numba JIT and per-thread SQLite connections for the storage modules
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+# Optional JIT compilation: njit is a no-op decorator when Numba is missing
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit when Numba is not installed."""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+def thread_connection(local: threading.local, db_path: str, *pragmas: str) -> sqlite3.Connection:
+    """This thread's long-lived autocommit connection to db_path, opened on first use.
+    Writes are grouped into explicit transactions (see transaction), and WAL +
+    synchronous=NORMAL avoids an fsync per insert while other threads keep reading.
+    Extra PRAGMA statements are run once when the connection is opened."""
+    conn = getattr(local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for pragma in pragmas:
+            conn.execute(pragma)
+        local.conn = conn
+    return conn
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Cursor]:
+    """Cursor inside BEGIN ... COMMIT, rolled back if the block raises"""
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    try:
+        yield cursor
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
@@ -0,0 +1,341 @@
+"""
+Vectorized Path Validation Script
+Checks each batched / array-based code path against the scalar logic it replaced
+
+Covers:
+- Detections table (concatenate / select / to_dicts) and array NMS
+- Detector result cache and batched detection
+- ASTMStandardsManager.determine_pass_fail_batch
+- Reference card table lookup (_CardTable.find)
+- memory_bank.image_hash_distance
+- IntegratedASTMAnalyzer.analyze_images_complete
+"""
+
+import sys
+import os
+import copy
+import json
+import tempfile
+sys.path.append('.')
+
+import cv2
+import numpy as np
+import torch
+
+import max_recall_detector
+from max_recall_detector import Detections, MaxRecallDefectDetector
+from astm_standards import ASTMStandardsManager, MetalType, QualityGrade
+from integrated_astm_analyzer import IntegratedASTMAnalyzer
+from astm_reference_generator import ASTMReferenceGenerator
+from memory_bank import generate_image_hash, image_hash_distance
+
+CLASS_NAMES = {0: 'crazing', 1: 'inclusion', 2: 'scratches'}
+
+def _random_detections(rng, n, pass_id=0):
+    """Random Detections table with valid xyxy boxes"""
+    xy = rng.uniform(0, 500, size=(n, 2))
+    wh = rng.uniform(5, 80, size=(n, 2))
+    return Detections(
+        boxes=np.hstack([xy, xy + wh]),
+        confidence=rng.uniform(0.05, 1.0, size=n),
+        class_id=rng.integers(0, len(CLASS_NAMES), size=n).astype(np.int32),
+        pass_id=np.full(n, pass_id, dtype=np.int32)
+    )
+
+def _scalar_iou(box1, box2):
+    """Reference IoU of two boxes, in plain Python"""
+    x_left, y_top = max(box1[0], box2[0]), max(box1[1], box2[1])
+    x_right, y_bottom = min(box1[2], box2[2]), min(box1[3], box2[3])
+    if x_right < x_left or y_bottom < y_top:
+        return 0.0
+    intersection = (x_right - x_left) * (y_bottom - y_top)
+    union = ((box1[2] - box1[0]) * (box1[3] - box1[1]) +
+             (box2[2] - box2[0]) * (box2[3] - box2[1]) - intersection)
+    return intersection / union if union > 0 else 0.0
+
+def _scalar_nms(detections, iou_threshold):
+    """Reference greedy per-class NMS over a list of detection dicts; returns kept indices"""
+    kept = []
+    for class_id in sorted({d['class_id'] for d in detections}):
+        rows = [i for i, d in enumerate(detections) if d['class_id'] == class_id]
+        rows.sort(key=lambda i: detections[i]['confidence'], reverse=True)
+        class_kept = []
+        for i in rows:
+            if all(_scalar_iou(detections[i]['bbox'], detections[j]['bbox']) <= iou_threshold
+                   for j in class_kept):
+                class_kept.append(i)
+        kept.extend(class_kept)
+    return sorted(kept)
+
+class _FakeBoxes:
+    def __init__(self, data):
+        self.data = data
+
+class _FakeResult:
+    def __init__(self, data):
+        self.boxes = _FakeBoxes(data)
+
+class _FakeYOLO:
+    """Deterministic stand-in for a YOLO model: boxes depend only on the input image"""
+    names = CLASS_NAMES
+
+    def __init__(self):
+        self.images_seen = 0
+
+    def __call__(self, images, **kwargs):
+        if isinstance(images, np.ndarray):
+            images = [images]
+        self.images_seen += len(images)
+        return iter([_FakeResult(self._boxes_for(image)) for image in images])
+
+    @staticmethod
+    def _boxes_for(image):
+        height, width = image.shape[:2]
+        shade = float(image.mean()) / 255.0
+        return torch.tensor([
+            [0.10 * width, 0.10 * height, 0.40 * width, 0.50 * height, 0.90, 0],
+            [0.12 * width, 0.11 * height, 0.41 * width, 0.52 * height, 0.60, 0],
+            [0.50 * width, 0.55 * height, 0.80 * width, 0.90 * height, 0.05 + 0.9 * shade, 2],
+        ])
+
+class _FakeModelDetector(MaxRecallDefectDetector):
+    """MaxRecallDefectDetector running on _FakeYOLO"""
+
+    def _load_model(self, model_path, use_tensorrt):
+        return _FakeYOLO()
+
+class _RecordingBank:
+    """Memory bank stand-in that keeps stored detection batches in a list"""
+
+    def __init__(self):
+        self.batches = []
+
+    def store_detections(self, detections):
+        self.batches.append(detections)
+        return len(detections)
+
+def _make_detector():
+    return _FakeModelDetector("yolov8_model.pt", use_tensorrt=False)
+
+def _assert_results_equal(result_a, result_b):
+    assert result_a.keys() == result_b.keys()
+    for key in result_a:
+        if isinstance(result_a[key], np.ndarray):
+            np.testing.assert_array_equal(result_a[key], result_b[key])
+        else:
+            assert result_a[key] == result_b[key], key
+
+def test_detections_table():
+    """Detections concatenate / select / to_dicts against hand-built dicts"""
+    rng = np.random.default_rng(0)
+    parts = [_random_detections(rng, 4, pass_id=0), _random_detections(rng, 3, pass_id=1),
+             Detections.empty()]
+    pass_names = ["Pass 1", "Pass 2", "Pass 3"]
+
+    table = Detections.concatenate(parts)
+    assert len(table) == 7
+
+    expected = []
+    for part in parts:
+        for box, conf, cls, pass_id in zip(part.boxes, part.confidence, part.class_id, part.pass_id):
+            expected.append({
+                "bbox": [float(v) for v in box],
+                "confidence": float(conf),
+                "class_id": int(cls),
+                "class_name": CLASS_NAMES[int(cls)],
+                "pass_name": pass_names[int(pass_id)],
+                "area": float((box[2] - box[0]) * (box[3] - box[1]))
+            })
+    assert table.to_dicts(CLASS_NAMES, pass_names) == expected
+
+    index = np.array([5, 0, 3])
+    assert table.select(index).to_dicts(CLASS_NAMES, pass_names) == [expected[i] for i in index]
+    assert len(Detections.concatenate([])) == 0
+    print("✅ Detections table matches per-box dicts")
+
+def test_nms_matches_scalar():
+    """Array NMS (torchvision and NumPy fallback) keeps the same boxes as scalar greedy NMS"""
+    detector = _make_detector()
+    rng = np.random.default_rng(1)
+
+    for trial in range(20):
+        table = _random_detections(rng, int(rng.integers(1, 60)))
+        # Overlapping copies so suppression actually happens
+        jitter = table.select(np.arange(len(table)))
+        jitter.boxes = jitter.boxes + rng.normal(0, 3, size=jitter.boxes.shape)
+        jitter.confidence = rng.uniform(0.05, 1.0, size=len(jitter))
+        table = Detections.concatenate([table, jitter])
+
+        expected = _scalar_nms(table.to_dicts(CLASS_NAMES, ["Pass 1"]), detector.iou_threshold)
+
+        fallback_flag = max_recall_detector.TORCHVISION_AVAILABLE
+        try:
+            max_recall_detector.TORCHVISION_AVAILABLE = False
+            fallback_keep = detector._nms_keep(table).tolist()
+        finally:
+            max_recall_detector.TORCHVISION_AVAILABLE = fallback_flag
+        assert sorted(fallback_keep) == expected, trial
+        # Survivors come back by descending confidence
+        assert fallback_keep == sorted(expected, key=lambda i: -table.confidence[i]), trial
+
+        if fallback_flag:
+            # Same survivors in the same order as the fallback
+            assert detector._nms_keep(table).tolist() == fallback_keep, trial
+    print("✅ Array NMS matches scalar greedy NMS")
+
+def test_detector_cache_and_batch():
+    """Batched detection matches per-image detection; cached results are returned as copies"""
+    detector = _make_detector()
+    rng = np.random.default_rng(2)
+    images = [rng.integers(0, 256, size=(480 + 40 * i, 640, 3), dtype=np.uint8) for i in range(3)]
+
+    single = [detector.detect_all_defects(image, return_details=True) for image in images]
+    assert all("error" not in result for result in single)
+    # Results are plain Python data at the API boundary
+    for result in single:
+        json.dumps(result)
+
+    # Everything is cached now: no more model calls
+    images_seen = detector.model.images_seen
+    batch = detector.detect_all_defects_batch(images, return_details=True, batch_size=2)
+    assert detector.model.images_seen == images_seen
+    for result_single, result_batch in zip(single, batch):
+        _assert_results_equal(result_single, result_batch)
+
+    # Fresh detector: the batched path computes the same results from scratch
+    fresh = _make_detector()
+    for result_single, result_batch in zip(single, fresh.detect_all_defects_batch(
+            images, return_details=True, batch_size=2)):
+        _assert_results_equal(result_single, result_batch)
+
+    # Mutating a returned result must not leak into the cache
+    snapshot = copy.deepcopy(single[0])
+    single[0]["detections"].clear()
+    _assert_results_equal(detector.detect_all_defects(images[0], return_details=True), snapshot)
+
+    # Cached and freshly detected results are recorded alike
+    bank = _RecordingBank()
+    recorder = _make_detector()
+    recorder.memory_bank = bank
+    recorder.detect_all_defects(images[0])
+    recorder.detect_all_defects(images[0])
+    recorder.detect_all_defects_batch(images[:2])
+    counts = [len(result["detections"]) for result in (snapshot, single[1])]
+    assert [len(batch) for batch in bank.batches] == [counts[0], counts[0], counts[0], counts[1]]
+
+    # Summary counts match a plain dictionary count
+    counts = {}
+    for detection in snapshot["detections"]:
+        counts[detection["class_name"]] = counts.get(detection["class_name"], 0) + 1
+    summary = detector.get_detection_summary(snapshot)
+    for class_name, count in counts.items():
+        assert f"{class_name}: {count}" in summary
+    print("✅ Detector cache and batch match per-image detection")
+
+def test_pass_fail_batch_matches_scalar():
+    """determine_pass_fail_batch agrees with determine_pass_fail for every metal and grade"""
+    manager = ASTMStandardsManager()
+    rng = np.random.default_rng(3)
+
+    for metal_type in MetalType:
+        for grade in QualityGrade:
+            limit = manager.get_grade_limit(metal_type, grade)
+            sizes = np.concatenate([[0.0, limit, limit * 1.2, limit * 1.2 + 1e-9],
+                                    rng.uniform(0, limit * 2, size=50)])
+            results, confidences = manager.determine_pass_fail_batch(sizes, metal_type, grade)
+            expected = [manager.determine_pass_fail(float(size), metal_type, grade) for size in sizes]
+            assert results == [result for result, _ in expected]
+            assert confidences.tolist() == [confidence for _, confidence in expected]
+
+    # Per-defect metal types and grades
+    metals = list(MetalType) * 4
+    grades = [grade for grade in QualityGrade for _ in range(len(MetalType))]
+    sizes = rng.uniform(0, 0.5, size=len(metals))
+    results, _ = manager.determine_pass_fail_batch(sizes, metals, grades)
+    assert results == [manager.determine_pass_fail(float(size), metal, grade)[0]
+                       for size, metal, grade in zip(sizes, metals, grades)]
+    print("✅ Batched pass/fail matches scalar pass/fail")
+
+def test_card_table_find_matches_scan():
+    """_CardTable.find returns the same cards as a linear scan over all cards"""
+    generator = ASTMReferenceGenerator(seed=4)
+    rng = np.random.default_rng(4)
+    for metal_type in ('steel', 'aluminum', 'copper'):
+        for grade in ('A', 'B', 'C'):
+            for thickness in rng.uniform(0.5, 10.0, size=6):
+                generator.generate_reference_card(metal_type, grade, float(thickness))
+
+    cards = generator.reference_cards.cards
+    for metal_type in ('steel', 'aluminum', 'copper'):
+        for grade in ('A', 'B', 'C'):
+            for thickness in rng.uniform(0.5, 10.0, size=20):
+                expected = [card for card in cards
+                            if card.metal_type == metal_type and card.quality_grade == grade
+                            and card.thickness_range[0] <= thickness <= card.thickness_range[1]]
+                found = generator.find_reference_cards(metal_type, grade, float(thickness))
+                assert [card.id for card in found] == [card.id for card in expected]
+    print("✅ Card table lookup matches linear scan")
+
+def test_image_hash_distance():
+    """image_hash_distance equals a bit-by-bit count over the perceptual hashes"""
+    rng = np.random.default_rng(5)
+    base = rng.integers(0, 256, size=(120, 160, 3), dtype=np.uint8)
+    noisy = np.clip(base.astype(np.int16) + rng.integers(-3, 4, size=base.shape), 0, 255).astype(np.uint8)
+    other = rng.integers(0, 256, size=(120, 160, 3), dtype=np.uint8)
+
+    hashes = [generate_image_hash(image) for image in (base, noisy, other)]
+    assert generate_image_hash(base.copy()) == hashes[0]
+
+    for hash_a in hashes:
+        for hash_b in hashes:
+            bits_a = format(int(hash_a.split('_')[1], 16), '064b')
+            bits_b = format(int(hash_b.split('_')[1], 16), '064b')
+            expected = sum(a != b for a, b in zip(bits_a, bits_b))
+            assert image_hash_distance(hash_a, hash_b) == expected
+
+    assert image_hash_distance(hashes[0], hashes[0]) == 0
+    assert image_hash_distance(hashes[0], hashes[1]) < image_hash_distance(hashes[0], hashes[2])
+    print("✅ Hash distance matches bitwise count")
+
+def test_integrated_batch_analysis():
+    """analyze_images_complete matches analyze_image_complete per image; bad files get None"""
+    rng = np.random.default_rng(6)
+    with tempfile.TemporaryDirectory() as tmp:
+        image_paths = []
+        for i in range(2):
+            image_path = os.path.join(tmp, f"plate_{i}.png")
+            cv2.imwrite(image_path, rng.integers(0, 256, size=(400, 600, 3), dtype=np.uint8))
+            image_paths.append(image_path)
+        image_paths.append(os.path.join(tmp, "missing.png"))
+
+        analyzer = IntegratedASTMAnalyzer()
+        analyzer.detector = _make_detector()
+        analyzer.reference_generator = ASTMReferenceGenerator(seed=6, output_dir=os.path.join(tmp, "cards"))
+
+        batch = analyzer.analyze_images_complete(
+            image_paths, MetalType.CARBON_STEEL, 0.5, QualityGrade.GRADE_B
+        )
+        assert batch[-1] is None
+
+        for image_path, result in zip(image_paths[:-1], batch[:-1]):
+            assert result is not None and result.total_defects > 0
+            single = analyzer.analyze_image_complete(
+                image_path, MetalType.CARBON_STEEL, 0.5, QualityGrade.GRADE_B
+            )
+            assert result.total_defects == single.total_defects
+            assert result.astm_compliance == single.astm_compliance
+            assert result.compliance_details == single.compliance_details
+            assert result.similarity_scores == single.similarity_scores
+    print("✅ Batched integrated analysis matches per-image analysis")
+
+if __name__ == "__main__":
+    print("🔬 VECTORIZED PATH VALIDATION")
+    print("=" * 40)
+    test_detections_table()
+    test_nms_matches_scalar()
+    test_detector_cache_and_batch()
+    test_pass_fail_batch_matches_scalar()
+    test_card_table_find_matches_scan()
+    test_image_hash_distance()
+    test_integrated_batch_analysis()
+    print("\n🎉 All vectorized paths match their scalar versions")
@@ -118,7 +118,8 @@ class UnifiedIntelligentDefectAnalyzer:
             'enterprise_reporting': True,
             'grid_size': 50,
             'yellow_highlight_only': True,
-            'unknown_defect_reporting': True
+            'unknown_defect_reporting': True,
+            'record_detections': False  # Store every analysis's detections in the memory bank
         }
     
     def _initialize_subsystems(self):
@@ -151,6 +152,9 @@ class UnifiedIntelligentDefectAnalyzer:
             try:
                 print("   🔧 Initializing memory bank...")
                 self.memory_bank = MemoryBank()
+                # Recording turns each analysis into a database write, so it is opt-in
+                if self.config.get('record_detections', False):
+                    self.max_recall_detector.memory_bank = self.memory_bank
             except:
                 self.memory_bank = None
                 print("   ⚠️ Memory bank not available")
@@ -163,36 +167,52 @@ class UnifiedIntelligentDefectAnalyzer:
             self.systems_ready = False
     
     def analyze_image_unified(self, 
-                            image_path: str,
+                            image_path: Optional[str] = None,
                             metal_type: Optional[str] = None,
                             thickness: Optional[float] = None,
                             quality_grade: Optional[str] = None,
-                            enable_grid_analysis: bool = True) -> UnifiedAnalysisResult:
+                            enable_grid_analysis: bool = True,
+                            image_array: Optional[np.ndarray] = None,
+                            image_scale: float = 1.0) -> UnifiedAnalysisResult:
         """
         Perform complete unified intelligent analysis of a metal surface image.
         
         Args:
-            image_path: Path to the image to analyze
+            image_path: Path to the image to analyze (used as a display name
+                when image_array is given)
             metal_type: Metal type for ASTM compliance (optional)
             thickness: Metal thickness for ASTM compliance (optional)
             quality_grade: Required quality grade for ASTM compliance (optional)
             enable_grid_analysis: Enable advanced pixel-grid analysis
+            image_array: Already-decoded BGR image; skips reading from disk
+            image_scale: Factor the image was resized by before analysis; defect
+                sizes for ASTM compliance are measured at the original resolution
             
         Returns:
             UnifiedAnalysisResult with complete analysis data
         """
         
+        if image_array is None and image_path is None:
+            raise ValueError("Either image_path or image_array must be provided")
+        
         print("🔍 Starting Unified Intelligent Analysis")
         print("=" * 45)
-        print(f"📁 Image: {os.path.basename(image_path)}")
-        
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"Image file not found: {image_path}")
         
-        # Load image
-        image = cv2.imread(image_path)
-        if image is None:
-            raise ValueError(f"Could not load image: {image_path}")
+        if image_array is not None:
+            # In-memory handoff (e.g. web uploads): no disk round-trip
+            image = image_array
+            image_path = image_path or "uploaded_image"
+            print(f"📁 Image: {os.path.basename(image_path)} (in memory)")
+        else:
+            print(f"📁 Image: {os.path.basename(image_path)}")
+            
+            if not os.path.exists(image_path):
+                raise FileNotFoundError(f"Image file not found: {image_path}")
+            
+            # Load image
+            image = cv2.imread(image_path)
+            if image is None:
+                raise ValueError(f"Could not load image: {image_path}")
         
         height, width = image.shape[:2]
         timestamp = datetime.now().isoformat()
@@ -231,7 +251,7 @@ class UnifiedIntelligentDefectAnalyzer:
         # Step 1: Maximum Recall Detection
         print("\\n🎯 Step 1: Maximum Recall Defect Detection")
         detection_results = self.max_recall_detector.detect_all_defects(
-            image_path, return_details=True
+            image, return_details=True
         )
         
         if 'error' in detection_results:
@@ -266,7 +286,8 @@ class UnifiedIntelligentDefectAnalyzer:
         if metal_type and thickness and quality_grade:
             print("\\n📊 Step 4: ASTM Standards Compliance Analysis")
             compliance_result = self._check_astm_compliance(
-                image_path, detected_defects, metal_type, thickness, quality_grade
+                image_path, detected_defects, metal_type, thickness, quality_grade,
+                image_scale=image_scale
             )
             
             # Create standards compliance data structure
@@ -467,7 +488,8 @@ class UnifiedIntelligentDefectAnalyzer:
                              detected_defects: List[Dict],
                              metal_type: str,
                              thickness: float,
-                             quality_grade: str) -> Dict[str, Any]:
+                             quality_grade: str,
+                             image_scale: float = 1.0) -> Dict[str, Any]:
         """Check ASTM standards compliance - Phase 2 Enhanced"""
         
         try:
@@ -509,7 +531,8 @@ class UnifiedIntelligentDefectAnalyzer:
                 # Get defect size from bbox (if available)
                 if 'bbox' in defect:
                     bbox = defect['bbox']
-                    defect_size_pixels = max(bbox[2] - bbox[0], bbox[3] - bbox[1])
+                    # Measured in original-image pixels (undo any pre-analysis resize)
+                    defect_size_pixels = max(bbox[2] - bbox[0], bbox[3] - bbox[1]) / image_scale
                     defect_size_mm = defect_size_pixels / 10.0  # Approximate pixels per mm
                     defect_size_inches = defect_size_mm / 25.4
                     
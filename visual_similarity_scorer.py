@@ -8,6 +8,69 @@ import numpy as np
 from typing import Dict, List, Tuple, Optional, Any
 from dataclasses import dataclass
 import math
+import os
+
+# Optional JIT compilation for the global SSIM statistics
+from perf_helpers import NUMBA_AVAILABLE, njit
+
+# Use the compiled SSIM kernels only when they really are compiled
+_NUMBA_SSIM = NUMBA_AVAILABLE and os.environ.get("NUMBA_DISABLE_JIT", "0") == "0"
+
+# SSIM stabilizing constants
+_SSIM_C1 = 0.01 ** 2
+_SSIM_C2 = 0.03 ** 2
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _global_ssim_core(img_a, img_b, c1, c2):
+    """Single-window SSIM of two equally sized 2-D images from one pass of running sums"""
+    rows, cols = img_a.shape
+    sum_a = 0.0
+    sum_b = 0.0
+    sum_aa = 0.0
+    sum_bb = 0.0
+    sum_ab = 0.0
+    for y in range(rows):
+        for x in range(cols):
+            a = float(img_a[y, x])
+            b = float(img_b[y, x])
+            sum_a += a
+            sum_b += b
+            sum_aa += a * a
+            sum_bb += b * b
+            sum_ab += a * b
+    
+    n = rows * cols
+    mu_a = sum_a / n
+    mu_b = sum_b / n
+    var_a = sum_aa / n - mu_a * mu_a
+    var_b = sum_bb / n - mu_b * mu_b
+    cov = sum_ab / n - mu_a * mu_b
+    
+    numerator = (2 * mu_a * mu_b + c1) * (2 * cov + c2)
+    denominator = (mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2)
+    if denominator == 0.0:
+        return 1.0 if numerator == 0.0 else 0.0
+    return min(1.0, max(0.0, numerator / denominator))
+
+@njit(fastmath=True, cache=True, nogil=True)
+def _global_ssim_batch(stack, ref, c1, c2):
+    """_global_ssim_core of every image in an (N, H, W) stack against one reference
+    
+    Serial on purpose: callers score several defect types from a thread pool,
+    and parallel regions launched from several threads can abort the process.
+    """
+    out = np.empty(stack.shape[0])
+    for i in range(stack.shape[0]):
+        out[i] = _global_ssim_core(stack[i], ref, c1, c2)
+    return out
+
+# Contribution of each metric to the overall similarity score
+SIMILARITY_WEIGHTS = {
+    'histogram': 0.25,
+    'structural': 0.35,
+    'texture': 0.25,
+    'edge': 0.15
+}
 
 @dataclass
 class SimilarityResult:
@@ -26,6 +89,13 @@ class VisualSimilarityScorer:
         """Initialize the visual similarity scorer"""
         self.target_size = (256, 256)  # Standard size for comparison
         
+    def warm_up(self):
+        """Compile the SSIM kernels now so the first real comparison doesn't pay for it"""
+        if _NUMBA_SSIM:
+            dummy = np.zeros((8, 8), dtype=np.uint8)
+            _global_ssim_core(dummy, dummy, _SSIM_C1, _SSIM_C2)
+            _global_ssim_batch(dummy[None], dummy, _SSIM_C1, _SSIM_C2)
+    
     def calculate_similarity(self, 
                            test_image: np.ndarray, 
                            reference_image: np.ndarray,
@@ -43,19 +113,7 @@ class VisualSimilarityScorer:
         edge_sim = self._calculate_edge_similarity(test_processed, ref_processed)
         
         # Weighted overall score
-        weights = {
-            'histogram': 0.25,
-            'structural': 0.35,
-            'texture': 0.25,
-            'edge': 0.15
-        }
-        
-        overall_score = (
-            hist_sim * weights['histogram'] +
-            struct_sim * weights['structural'] +
-            texture_sim * weights['texture'] +
-            edge_sim * weights['edge']
-        )
+        overall_score = self._weighted_score(hist_sim, struct_sim, texture_sim, edge_sim)
         
         # Generate recommendations
         recommendations = self._generate_recommendations(
@@ -71,11 +129,75 @@ class VisualSimilarityScorer:
             recommendations=recommendations
         )
     
+    def get_similarity_percentage(self, test_image: np.ndarray, reference_image: np.ndarray) -> float:
+        """Overall visual similarity between two images as a percentage (0-100)"""
+        return self.get_similarity_percentages([test_image], reference_image)[0]
+    
+    def get_similarity_percentages(self, 
+                                   test_images: List[np.ndarray], 
+                                   reference_image: np.ndarray) -> List[float]:
+        """
+        get_similarity_percentage for many test images (e.g. defect crops) against
+        one reference: the reference is preprocessed once and the structural
+        similarity is computed for the whole stack in one vectorized pass
+        """
+        if not test_images:
+            return []
+        return self.get_similarity_percentages_prepared(test_images, self.prepare_reference(reference_image))
+    
+    def prepare_reference(self, reference_image: np.ndarray) -> np.ndarray:
+        """Preprocessed grayscale reference, reusable across get_similarity_percentages_prepared calls"""
+        ref_processed = self._preprocess_image(reference_image)
+        if ref_processed.ndim == 3:
+            ref_processed = cv2.cvtColor(ref_processed, cv2.COLOR_BGR2GRAY)
+        return ref_processed
+    
+    def get_similarity_percentages_prepared(self, 
+                                            test_images: List[np.ndarray], 
+                                            ref_processed: np.ndarray) -> List[float]:
+        """get_similarity_percentages against a reference from prepare_reference"""
+        if not test_images:
+            return []
+        
+        batch = np.stack([self._preprocess_image(image) for image in test_images])
+        
+        # Every metric works on grayscale: convert once here (the stack as one
+        # tall image) instead of twice per metric per crop
+        if batch.ndim == 4:
+            n, height, width = batch.shape[:3]
+            batch = cv2.cvtColor(batch.reshape(n * height, width, 3), cv2.COLOR_BGR2GRAY).reshape(n, height, width)
+        
+        struct_sims = self._calculate_structural_similarity_batch(batch, ref_processed)
+        
+        percentages = []
+        for processed, struct_sim in zip(batch, struct_sims.tolist()):
+            hist_sim = self._calculate_histogram_similarity(processed, ref_processed)
+            texture_sim = self._calculate_texture_similarity(processed, ref_processed)
+            edge_sim = self._calculate_edge_similarity(processed, ref_processed)
+            percentages.append(self._weighted_score(hist_sim, struct_sim, texture_sim, edge_sim) * 100)
+        
+        return percentages
+    
+    @staticmethod
+    def _weighted_score(hist_sim: float, struct_sim: float, texture_sim: float, edge_sim: float) -> float:
+        """Combine the individual metrics into the overall score"""
+        return (
+            hist_sim * SIMILARITY_WEIGHTS['histogram'] +
+            struct_sim * SIMILARITY_WEIGHTS['structural'] +
+            texture_sim * SIMILARITY_WEIGHTS['texture'] +
+            edge_sim * SIMILARITY_WEIGHTS['edge']
+        )
+    
     def _preprocess_image(self, image: np.ndarray) -> np.ndarray:
         """Preprocess image for similarity analysis"""
         
-        # Resize to standard size
-        resized = cv2.resize(image, self.target_size)
+        # Resize to standard size (area averaging when shrinking avoids aliasing)
+        height, width = image.shape[:2]
+        if width >= self.target_size[0] and height >= self.target_size[1]:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_LINEAR
+        resized = cv2.resize(image, self.target_size, interpolation=interpolation)
         
         # Normalize lighting
         if len(resized.shape) == 3:
@@ -124,6 +246,9 @@ class VisualSimilarityScorer:
         else:
             gray1, gray2 = img1, img2
         
+        if _NUMBA_SSIM:
+            return _global_ssim_core(gray1, gray2, _SSIM_C1, _SSIM_C2)
+        
         # Convert to float
         img1_float = gray1.astype(np.float64)
         img2_float = gray2.astype(np.float64)
@@ -137,13 +262,9 @@ class VisualSimilarityScorer:
         var2 = np.var(img2_float)
         cov = np.mean((img1_float - mu1) * (img2_float - mu2))
         
-        # SSIM constants
-        c1 = 0.01 ** 2
-        c2 = 0.03 ** 2
-        
         # Calculate SSIM
-        numerator = (2 * mu1 * mu2 + c1) * (2 * cov + c2)
-        denominator = (mu1**2 + mu2**2 + c1) * (var1 + var2 + c2)
+        numerator = (2 * mu1 * mu2 + _SSIM_C1) * (2 * cov + _SSIM_C2)
+        denominator = (mu1**2 + mu2**2 + _SSIM_C1) * (var1 + var2 + _SSIM_C2)
         
         if denominator == 0:
             return 1.0 if numerator == 0 else 0.0
@@ -151,6 +272,29 @@ class VisualSimilarityScorer:
         ssim = numerator / denominator
         return max(0, min(1, ssim))
     
+    def _calculate_structural_similarity_batch(self, batch: np.ndarray, reference: np.ndarray) -> np.ndarray:
+        """_calculate_structural_similarity of every image in a grayscale (N, H, W) stack vs one grayscale reference"""
+        
+        if _NUMBA_SSIM:
+            return _global_ssim_batch(batch, reference, _SSIM_C1, _SSIM_C2)
+        
+        imgs = batch.reshape(len(batch), -1).astype(np.float64)
+        ref = reference.reshape(-1).astype(np.float64)
+        
+        # Per-image means, variances and covariance with the reference
+        mu1 = imgs.mean(axis=1)
+        mu2 = ref.mean()
+        var1 = imgs.var(axis=1)
+        var2 = ref.var()
+        cov = ((imgs - mu1[:, None]) * (ref - mu2)).mean(axis=1)
+        
+        numerator = (2 * mu1 * mu2 + _SSIM_C1) * (2 * cov + _SSIM_C2)
+        denominator = (mu1**2 + mu2**2 + _SSIM_C1) * (var1 + var2 + _SSIM_C2)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ssim = np.where(denominator == 0, (numerator == 0).astype(np.float64), numerator / denominator)
+        return np.clip(ssim, 0, 1)
+    
     def _calculate_texture_similarity(self, img1: np.ndarray, img2: np.ndarray) -> float:
         """Calculate texture-based similarity using Local Binary Patterns"""
         